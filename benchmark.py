@@ -0,0 +1,126 @@
+# Imports
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from generate_data import generate
+
+# Benchmark runner for SuperPy: times commands on generated stores of several sizes and saves the results as JSON.
+SUPER_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "super.py")
+
+def get_benchmarks(last_day):
+    """
+    Returns the commands to time as (name, arguments) for a store whose current date is last_day.
+    """
+    return [
+        ("sell", ["sell", "--product-name", "apples", "--price", "2"]),
+        ("inventory", ["inventory", "--now", "--group"]),
+        ("report-revenue", ["report-revenue", "--year", str(last_day.year)]),
+        ("report-profit", ["report-profit", "--month", last_day.strftime("%Y-%m")]),
+    ]
+
+def run_command(directory, arguments, storage):
+    """
+    Runs 'super.py' once in directory and returns its wall time in seconds and its peak memory in KiB.
+    """
+    command = [sys.executable, SUPER_PY, "--storage", storage] + arguments
+    environment = dict(os.environ, MPLBACKEND="Agg")  # Charts are rendered, but never shown
+
+    with tempfile.TemporaryFile() as errors:
+        # os.wait4 gives the resource usage of this one process, instead of all finished processes together
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=directory, env=environment, stdout=subprocess.DEVNULL, stderr=errors)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f"{' '.join(arguments)} failed with exit code {process.returncode}:\n{errors.read().decode()}")
+
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS
+    peak_memory = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return wall_time, peak_memory
+
+def get_version():
+    """
+    Returns the git commit of SuperPy that is benchmarked, or None if it isn't in a git repository.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(SUPER_PY), capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+def main():
+    """
+    Runs every benchmark at every scale and writes the results to a JSON file.
+    """
+    parser = argparse.ArgumentParser(description="SuperPy - Benchmark commands on generated data")
+    parser.add_argument("--scales", default="10000,100000", help="Comma-separated numbers of purchases to generate (default: 10000,100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times every command is timed (default: 3)")
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default="csv", help="Storage to benchmark (default: csv)")
+    parser.add_argument("--output", default="benchmark_results.json", help="File to write the results to (default: benchmark_results.json)")
+    parser.add_argument("--label", help="Name for this run in the results, for example the branch being tested")
+    args = parser.parse_args()
+
+    results = []
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"Generating {scale} purchases...")
+            sales, last_day = generate(directory, scale)
+
+            # Skip the welcome message
+            with open(os.path.join(directory, "welcome_shown.txt"), "w") as welcome_file:
+                welcome_file.write("Benchmark")
+            if args.storage == "sqlite":
+                run_command(directory, ["import"], "csv")
+
+            # The first run builds indexes and caches, so it is timed as a warm-up run of its own
+            for name, arguments in get_benchmarks(last_day):
+                warmup_time, warmup_memory = run_command(directory, arguments, args.storage)
+                wall_times = []
+                peak_memory = warmup_memory
+                for _ in range(args.repeat):
+                    wall_time, memory = run_command(directory, arguments, args.storage)
+                    wall_times.append(wall_time)
+                    peak_memory = max(peak_memory, memory)
+
+                results.append({
+                    "scale": scale,
+                    "sales": sales,
+                    "command": name,
+                    "arguments": arguments,
+                    "warmup_seconds": round(warmup_time, 4),
+                    "wall_seconds": [round(wall_time, 4) for wall_time in wall_times],
+                    "median_seconds": round(statistics.median(wall_times), 4) if wall_times else None,
+                    "peak_memory_kib": peak_memory,
+                })
+                median = results[-1]["median_seconds"]
+                print(f"  {name:<16} median {median} s, peak memory {peak_memory // 1024} MiB")
+
+    report = {
+        "label": args.label,
+        "version": get_version(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": args.storage,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"OK: Wrote {len(results)} results to {args.output}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Imports
+import argparse
+import csv
+import heapq
+import os
+import random
+from datetime import date, timedelta
+
+# Data generator for SuperPy: writes bought.csv and sold.csv with realistic purchases and sales, for benchmarks.
+PRODUCT_WORDS = [
+    "apples", "bananas", "oranges", "pears", "kiwis", "grapes", "lemons", "pineapple", "mango", "strawberries",
+    "tomatoes", "cucumber", "lettuce", "carrots", "onions", "potatoes", "broccoli", "spinach", "mushrooms", "peppers",
+    "milk", "yoghurt", "butter", "cheese", "eggs", "cream", "bread", "croissants", "rice", "pasta",
+    "flour", "sugar", "coffee", "tea", "chocolate", "cookies", "chips", "juice", "water", "soda",
+]
+SHELF_LIVES = [(3, 10), (7, 30), (30, 120), (180, 720)]  # Ranges of days a product keeps: fresh, chilled, packed and dry
+DERIVED_FILES = ["sold_index.csv", "stock_checkpoints.json", "bought.csv.cache", "sold.csv.cache", "columns.npz", "superpy.db", "last_id.txt"]
+
+def make_products(count, rng):
+    """
+    Returns count products as (name, shelf life range, base price), named after groceries with a number for variants.
+    """
+    products = []
+    for number in range(count):
+        word = PRODUCT_WORDS[number % len(PRODUCT_WORDS)]
+        name = word if number < len(PRODUCT_WORDS) else f"{word}-{number // len(PRODUCT_WORDS)}"
+        products.append((name, rng.choice(SHELF_LIVES), round(rng.uniform(0.2, 25.0), 2)))
+    return products
+
+def generate(directory, rows, products=200, days=3 * 365, sold_fraction=0.8, start_date=date(2021, 1, 1), seed=1):
+    """
+    Writes a store with the given number of purchases to directory: bought.csv, sold.csv (in date order) and current_time.txt.
+    Every purchase is sold with probability sold_fraction, before it expires and before the last day; the rest stays in stock
+    or expires. Popular products are bought more often. Files derived from older data in directory are removed.
+    Returns the number of sales and the last day, which is also the current date of the store.
+    """
+    rng = random.Random(seed)
+    catalog = make_products(products, rng)
+    popularity = [1 / (rank + 1) for rank in range(len(catalog))]
+    last_day = start_date + timedelta(days=days - 1)
+
+    for filename in DERIVED_FILES:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+
+    # Ids count up from 1 for purchases and go on after the last purchase for sales, so they are unique and stay
+    # below the timestamps that SuperPy hands out to new rows
+    pending_sales = []  # Heap of (sell_date, bought_id, sell_price), so sales are written in date order
+    next_sale_id = rows + 1
+    sales = 0
+
+    with open(os.path.join(directory, "bought.csv"), "w", newline="") as bought_file, \
+            open(os.path.join(directory, "sold.csv"), "w", newline="") as sold_file:
+        bought_writer = csv.writer(bought_file)
+        sold_writer = csv.writer(sold_file)
+        bought_writer.writerow(["id", "product_name", "buy_date", "buy_price", "expiration_date"])
+        sold_writer.writerow(["id", "bought_id", "sell_date", "sell_price"])
+
+        bought_id = 0
+        for day in range(days):
+            buy_date = start_date + timedelta(days=day)
+            buy_date_text = buy_date.isoformat()
+
+            # Write the sales up to this day before the purchases of the day
+            while pending_sales and pending_sales[0][0] <= buy_date_text:
+                sell_date, sold_id, sell_price = heapq.heappop(pending_sales)
+                sold_writer.writerow([next_sale_id, sold_id, sell_date, sell_price])
+                next_sale_id += 1
+                sales += 1
+
+            # Spread the purchases evenly over the days
+            purchases = rows * (day + 1) // days - rows * day // days
+            for product_name, (shortest, longest), base_price in rng.choices(catalog, weights=popularity, k=purchases):
+                bought_id += 1
+                shelf_life = rng.randint(shortest, longest)
+                buy_price = round(base_price * rng.uniform(0.8, 1.2), 2)
+                bought_writer.writerow([bought_id, product_name, buy_date_text, buy_price, (buy_date + timedelta(days=shelf_life)).isoformat()])
+
+                if rng.random() < sold_fraction:
+                    sell_date = buy_date + timedelta(days=rng.randint(0, shelf_life))
+                    if sell_date <= last_day:
+                        heapq.heappush(pending_sales, (sell_date.isoformat(), bought_id, round(buy_price * rng.uniform(1.1, 1.8), 2)))
+
+        while pending_sales:
+            sell_date, sold_id, sell_price = heapq.heappop(pending_sales)
+            sold_writer.writerow([next_sale_id, sold_id, sell_date, sell_price])
+            next_sale_id += 1
+            sales += 1
+
+    with open(os.path.join(directory, "current_time.txt"), "w") as time_file:
+        time_file.write(last_day.isoformat())
+
+    return sales, last_day
+
+def main():
+    """
+    Generates a store in the given directory from the command line.
+    """
+    parser = argparse.ArgumentParser(description="SuperPy - Generate bought.csv and sold.csv for benchmarks")
+    parser.add_argument("rows", type=int, help="Number of purchases to generate, for example 10000 to 10000000")
+    parser.add_argument("--directory", default=".", help="Directory to write the files to (default: current directory)")
+    parser.add_argument("--products", type=int, default=200, help="Number of different products (default: 200)")
+    parser.add_argument("--days", type=int, default=3 * 365, help="Number of days of history (default: 1095)")
+    parser.add_argument("--start-date", default="2021-01-01", help="First day of the history (format: YYYY-MM-DD, default: 2021-01-01)")
+    parser.add_argument("--sold-fraction", type=float, default=0.8, help="Share of the purchases that is sold (default: 0.8)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the random numbers, the same seed gives the same files (default: 1)")
+    args = parser.parse_args()
+
+    sales, last_day = generate(
+        args.directory, args.rows, args.products, args.days, args.sold_fraction, date.fromisoformat(args.start_date), args.seed
+    )
+    print(f"OK: Generated {args.rows} purchases and {sales} sales in {args.directory}; the current date is {last_day}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Imports
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+# Stress test for SuperPy: sells the same stock from many processes at once and checks that no lot is sold twice.
+SUPER_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "super.py")
+
+def prepare_store(directory, lots):
+    """
+    Fills an empty store directory with the given number of lots of a single product.
+    """
+    with open(os.path.join(directory, "bought.csv"), "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["id", "product_name", "buy_date", "buy_price", "expiration_date"])
+        for lot in range(1, lots + 1):
+            writer.writerow([lot, "stress", "2023-01-01", "1.0", "2099-12-31"])
+
+    with open(os.path.join(directory, "current_time.txt"), "w") as time_file:
+        time_file.write("2023-06-01")
+
+    # Skip the welcome message
+    with open(os.path.join(directory, "welcome_shown.txt"), "w") as welcome_file:
+        welcome_file.write("Stress test")
+
+def run_sellers(directory, processes, sells_per_process, storage):
+    """
+    Starts all sellers at the same time and waits for them. Every seller runs 'super.py sell' sells_per_process times.
+    Returns the number of sales that were reported as OK.
+    """
+    sell_command = f'"{sys.executable}" "{SUPER_PY}" --storage {storage} sell --product-name stress --price 2'
+    script = "; ".join([sell_command] * sells_per_process)
+
+    sellers = [
+        subprocess.Popen(script, shell=True, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for _ in range(processes)
+    ]
+
+    reported_sales = 0
+    for seller in sellers:
+        output, _ = seller.communicate()
+        reported_sales += sum(1 for line in output.splitlines() if line.startswith("OK:"))
+    return reported_sales
+
+def read_sales(directory, storage):
+    """
+    Returns the (id, bought_id) of every sale in the store.
+    """
+    if storage == "sqlite":
+        import sqlite3
+
+        connection = sqlite3.connect(os.path.join(directory, "superpy.db"))
+        return list(connection.execute("SELECT id, bought_id FROM sold"))
+
+    with open(os.path.join(directory, "sold.csv"), newline="") as csvfile:
+        return [(row["id"], row["bought_id"]) for row in csv.DictReader(csvfile)]
+
+def main():
+    """
+    Runs the stress test and exits with status 1 if a lot was sold more than once or a sale went missing.
+    """
+    parser = argparse.ArgumentParser(description="SuperPy - Stress test for concurrent sales")
+    parser.add_argument("--processes", type=int, default=8, help="Number of sellers running at the same time (default: 8)")
+    parser.add_argument("--sells-per-process", type=int, default=10, help="Number of sales every seller attempts (default: 10)")
+    parser.add_argument("--lots", type=int, help="Number of lots in stock (default: half of all attempted sales)")
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default="csv", help="Storage to test (default: csv)")
+    args = parser.parse_args()
+
+    attempts = args.processes * args.sells_per_process
+    lots = args.lots if args.lots is not None else max(1, attempts // 2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_store(directory, lots)
+        if args.storage == "sqlite":
+            subprocess.run([sys.executable, SUPER_PY, "import"], cwd=directory, check=True, stdout=subprocess.DEVNULL)
+
+        reported_sales = run_sellers(directory, args.processes, args.sells_per_process, args.storage)
+        sales = read_sales(directory, args.storage)
+
+    errors = []
+    sold_twice = [bought_id for bought_id, count in Counter(bought_id for sale_id, bought_id in sales).items() if count > 1]
+    if sold_twice:
+        errors.append(f"{len(sold_twice)} lots were sold more than once.")
+    repeated_ids = [sale_id for sale_id, count in Counter(sale_id for sale_id, bought_id in sales).items() if count > 1]
+    if repeated_ids:
+        errors.append(f"{len(repeated_ids)} sale ids were handed out more than once.")
+    if len(sales) != reported_sales:
+        errors.append(f"{reported_sales} sales were reported, but {len(sales)} were recorded.")
+    if len(sales) != min(lots, attempts):
+        errors.append(f"Expected {min(lots, attempts)} sales, but {len(sales)} were recorded.")
+
+    print(f"{args.processes} processes attempted {attempts} sales of {lots} lots; {len(sales)} were recorded.")
+    for error in errors:
+        print(f"ERROR: {error}")
+    if errors:
+        sys.exit(1)
+    print("OK: Every lot was sold at most once.")
+
+if __name__ == "__main__":
+    main()
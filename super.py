@@ -1,12 +1,32 @@
 # Imports
+import time
+
+IMPORT_START = time.perf_counter()  # For --timing
+
 import argparse
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import marshal
+import sqlite3
+import tempfile
+import zipfile
 from datetime import datetime, date, timedelta
-from rich.console import Console
-from rich.table import Table
-from rich.text import Text
 import os
-import matplotlib.pyplot as plt
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows, so ids are only unique and commands only locked within one process
+
+# rich and matplotlib are slow to import, so they are only imported by the commands that use them
 
 # Do not change these lines.
 __winc_id__ = "a2bc36ea784242e4989deb157d527ba0"
@@ -14,6 +34,143 @@ __human_name__ = "superpy"
 
 # Your code below this line.
 TIME_FILE = "current_time.txt"  # Filename for time
+BOUGHT_FILE = "bought.csv"  # Filename for purchases
+SOLD_FILE = "sold.csv"  # Filename for sales
+SOLD_INDEX_FILE = "sold_index.csv"  # Filename for the sell_date index of sales
+SOLD_INDEX_RECORD_SIZE = 24  # Bytes per line of the sell_date index: "YYYY-MM-DD,<12-digit offset>\n"
+SOLD_INDEX_HEADER_LINES = 10  # Lines of the sell_date index taken by its header, the state of 'sold.csv' it was built from
+ID_FILE = "last_id.txt"  # Filename for the last id handed out
+CHECKPOINT_FILE = "stock_checkpoints.json"  # Filename for the saved stock per day or month
+ARCHIVE_DIRECTORY = "archive"  # Directory for the purchases and sales that 'compact' moved out of the working files
+ROLLUP_FILE = os.path.join(ARCHIVE_DIRECTORY, "rollup.json")  # Filename for the revenue and profit of all archived sales
+PROFILE_FILE = "superpy.prof"  # Filename for the cProfile statistics of the last command run with --profile
+METRICS_FILE = "superpy_metrics.jsonl"  # Filename for the timings and counters of every command run with --metrics or --profile
+LOCK_FILE = "superpy.lock"  # Filename for the lock that lets one command at a time use the storage
+SOCKET_FILE = "superpy.sock"  # Filename for the Unix socket of the server
+LOCAL_COMMANDS = {None, "advance-time", "serve"}  # Commands that never go through the server
+SERVER_REFUSED_COMMANDS = {"reindex", "import", "export", "compact"}  # Commands that replace files the server is using
+DATABASE_FILE = "superpy.db"  # Filename for the SQLite storage
+DATABASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bought (id TEXT, product_name TEXT, buy_date TEXT, buy_price TEXT, expiration_date TEXT);
+CREATE TABLE IF NOT EXISTS sold (id TEXT, bought_id TEXT, sell_date TEXT, sell_price TEXT);
+CREATE INDEX IF NOT EXISTS bought_id_index ON bought (id);
+CREATE INDEX IF NOT EXISTS bought_product_name_index ON bought (product_name);
+CREATE INDEX IF NOT EXISTS bought_buy_date_index ON bought (buy_date);
+CREATE INDEX IF NOT EXISTS sold_sell_date_index ON sold (sell_date);
+CREATE INDEX IF NOT EXISTS sold_bought_id_index ON sold (bought_id);
+"""
+CACHE_SUFFIX = ".cache"  # Suffix of the files next to the CSV files that cache their parsed rows
+CACHE_CHUNK_LIMIT = 64  # Number of appended chunks after which a cache file is rewritten as a single chunk
+COLUMN_CACHE_FILE = "columns.npz"  # Filename for the NumPy columns of 'bought.csv' and 'sold.csv', for --columnar
+BOUGHT_FIELDNAMES = ["id", "product_name", "buy_date", "buy_price", "expiration_date"]
+SOLD_FIELDNAMES = ["id", "bought_id", "sell_date", "sell_price"]
+
+WORKER_BUY_PRICES = {}  # Buy price per purchase id, in the worker processes of --jobs
+PHASE_TIMES = {"import": 0.0, "parse": 0.0, "io": 0.0, "render": 0.0}  # Seconds spent per phase, for --timing
+COUNTERS = {"file_opens": 0, "rows_parsed": 0, "date_parses": 0, "bytes_read": 0}  # Work done by a command, for --metrics
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in a block (or a decorated function) to the given phase in PHASE_TIMES.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_TIMES[phase] += time.perf_counter() - start
+
+def add_to_counter(counter, amount=1):
+    """
+    Adds amount to the given counter in COUNTERS. Counting is cheap, so it is done once per file, batch or date, never per byte.
+    """
+    COUNTERS[counter] += amount
+
+def count_file_opens(event, arguments):
+    """
+    Audit hook that counts the files SuperPy opens, including SQLite databases. Imported Python modules are not counted.
+    """
+    if event == "open":
+        path = arguments[0]
+        if isinstance(path, (str, bytes)) and not os.fsdecode(path).endswith((".py", ".pyc")):
+            add_to_counter("file_opens")
+    elif event == "sqlite3.connect":
+        add_to_counter("file_opens")
+
+def print_timing(total):
+    """
+    Prints the time spent per phase to stderr, so it doesn't mix with the output of the command.
+    """
+    phases = ", ".join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in PHASE_TIMES.items())
+    print(f"Timing: {phases}, total {total * 1000:.1f} ms", file=sys.stderr)
+
+def save_metrics(args, total):
+    """
+    Appends the time spent per phase and the counters of a command as one JSON line to the metrics file,
+    so slow commands can be compared over time.
+    """
+    metrics = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "command": args.command,
+        "arguments": sys.argv[1:],
+        "storage": args.storage,
+        "profiled": args.profile,
+        "seconds": dict({phase: round(seconds, 6) for phase, seconds in PHASE_TIMES.items()}, total=round(total, 6)),
+        "counters": COUNTERS,
+    }
+    with open(METRICS_FILE, "a") as metrics_file:
+        metrics_file.write(json.dumps(metrics) + "\n")
+
+def save_profile(profile):
+    """
+    Saves the statistics of a cProfile run to the profile file and prints the functions that took longest to stderr.
+    """
+    import pstats
+
+    profile.dump_stats(PROFILE_FILE)
+    print(f"Profile: saved to {PROFILE_FILE}, view it with 'python -m pstats {PROFILE_FILE}'", file=sys.stderr)
+    pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+
+def import_rich():
+    """
+    Imports the parts of rich that are used to render output.
+    """
+    with timed("import"):
+        from rich.console import Console
+        from rich.table import Table
+    return Console, Table
+
+def import_pyplot(headless=False):
+    """
+    Imports matplotlib's pyplot, which is only needed for charts.
+    Headless, the Agg backend is used, which only renders to files and never needs a display.
+    """
+    with timed("import"):
+        if headless:
+            import matplotlib
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    return plt
+
+def import_numpy():
+    """
+    Imports NumPy, which is optional and only needed for --columnar. Returns None if it isn't installed.
+    """
+    with timed("import"):
+        try:
+            import numpy
+        except ImportError:
+            return None
+    return numpy
+
+def parse_date(text, date_format=None):
+    """
+    Parses a date in the given strptime format, or in the format YYYY-MM-DD (which is much faster) without one.
+    """
+    add_to_counter("date_parses")
+    if date_format is None:
+        return date.fromisoformat(text)
+    return datetime.strptime(text, date_format).date()
 
 def get_current_time():
     """
@@ -22,7 +179,7 @@ def get_current_time():
     try:
         with open(TIME_FILE, "r") as time_file:
             current_time_str = time_file.read().strip()
-            return datetime.strptime(current_time_str, "%Y-%m-%d").date()
+            return parse_date(current_time_str)
     except FileNotFoundError:
         # If the file doesn't exist, use current time
         return datetime.now().date()
@@ -31,356 +188,2364 @@ def save_current_time(current_time):
     """
     Saves the provided current_time to the 'current_time.txt' file in the format '%Y-%m-%d'.
     """
-    with open(TIME_FILE, "w") as time_file:
-        time_file.write(current_time.strftime("%Y-%m-%d"))
+    write_file_atomic(TIME_FILE, current_time.strftime("%Y-%m-%d"))
 
-def is_product_sold(bought_id):
+def write_file_atomic(filename, text):
+    """
+    Replaces the contents of a file in one step, by writing to a temporary file and renaming it.
+    Readers never see a half-written file, and a crash leaves the old contents in place.
     """
-    Checks if a product with the given bought_id has been sold by searching in the 'sold.csv' file.
+    directory = os.path.dirname(os.path.abspath(filename))
+    binary = isinstance(text, bytes)
+    with tempfile.NamedTemporaryFile("wb" if binary else "w", dir=directory, prefix=".superpy-", newline=None if binary else "", delete=False) as temp_file:
+        temp_file.write(text)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_file.name, filename)
+
+@contextmanager
+def storage_lock():
     """
-    with open("sold.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row["bought_id"] == bought_id:
-                return True
-    return False
+    Holds an exclusive advisory lock on 'superpy.lock' while a command reads, checks and writes the storage,
+    so concurrent SuperPy processes can't sell the same lot twice or interleave their appends.
+    """
+    if fcntl is None:
+        yield
+        return
 
-def sell_product(product_name, sell_price):
+    with open(LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)  # Released when the file is closed
+        yield
+
+class Ledger:
     """
-    Sells a product by checking if it's in stock, not expired, and not already sold.
-    If conditions are met, records the sale in 'sold.csv'.
+    Holds rows of bought and sold products in memory, so every command reads its data only once.
+    The sell dates of all sold products are kept in a dict by bought_id, for constant time 'is sold' checks.
+    Depending on the storage, a ledger holds all rows or only the rows a command needs.
     """
-    # Check if product is bought
-    with open("bought.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        found_products = []
+    def __init__(self, bought, sold, storage):
+        self.bought = bought
+        self.sold = sold
+        self.storage = storage
+        self.sell_dates = {}
+        for row in sold:
+            self.add_sell_date(row)
+        self.bought_by_id = {row["id"]: row for row in bought}
+        self.unsold_lots = None  # Expiration dates and unsold lots per product, indexed on first use
+
+    def add_sell_date(self, row):
+        """
+        Remembers the date a lot was sold, keeping the earliest date if it was (wrongly) sold more than once.
+        """
+        sell_date = self.sell_dates.get(row["bought_id"])
+        if sell_date is None or row["sell_date"] < sell_date:
+            self.sell_dates[row["bought_id"]] = row["sell_date"]
+
+    def index_unsold_lots(self):
+        """
+        Returns the unsold lots of every product, building the index on first use.
+        Every product has a sorted list of the expiration dates of its unsold lots, so the first date can be found with
+        a binary search, and a dict with a deque of (expiration_date, position, lot) entries per date, in buy order.
+        Lots are sold from the front of their deque, so a sale doesn't have to move the other lots.
+        """
+        if self.unsold_lots is None:
+            self.unsold_lots = {}
+            for position, row in enumerate(self.bought):
+                dates, lots_by_date = self.unsold_lots.setdefault(row["product_name"], ([], {}))
+                if row["id"] not in self.sell_dates:
+                    lots_by_date.setdefault(row["expiration_date"], deque()).append((row["expiration_date"], position, row))
+            for dates, lots_by_date in self.unsold_lots.values():
+                dates.extend(sorted(lots_by_date))
+        return self.unsold_lots
+
+    def get_unsold_lots(self, product_name):
+        """
+        Returns the expiration dates and the unsold lots per date of a product (see index_unsold_lots).
+        Returns None if the product was never bought, and no dates if all of it has been sold.
+        """
+        return self.index_unsold_lots().get(product_name)
+
+    def iter_unsold_lots(self, product_name):
+        """
+        Yields the unsold lots of a product as (expiration_date, position, lot) entries, the first to expire first.
+        """
+        dates, lots_by_date = self.index_unsold_lots()[product_name]
+        for expiration_date in dates:
+            yield from lots_by_date[expiration_date]
+
+    def record_purchase(self, row):
+        """
+        Adds a purchase to the in-memory ledger, without writing it to the storage.
+        """
+        self.bought.append(row)
+        self.bought_by_id[row["id"]] = row
+        if self.unsold_lots is not None:
+            dates, lots_by_date = self.unsold_lots.setdefault(row["product_name"], ([], {}))
+            lots = lots_by_date.get(row["expiration_date"])
+            if lots is None:
+                lots = lots_by_date[row["expiration_date"]] = deque()
+                dates.insert(bisect_left(dates, row["expiration_date"]), row["expiration_date"])
+            lots.append((row["expiration_date"], len(self.bought) - 1, row))
+
+    def record_sale(self, row):
+        """
+        Adds a sale to the in-memory ledger, without writing it to the storage.
+        """
+        self.sold.append(row)
+        self.add_sell_date(row)
+
+        # Take the sold lot out of the unsold lots of its product
+        bought_product = self.bought_by_id.get(row["bought_id"])
+        if self.unsold_lots is not None and bought_product is not None:
+            dates, lots_by_date = self.unsold_lots.get(bought_product["product_name"], ([], {}))
+            expiration_date = bought_product["expiration_date"]
+            lots = lots_by_date.get(expiration_date, ())
+
+            # Lots are sold first in, first out, so the sold lot is nearly always at the front of its deque
+            for position, entry in enumerate(lots):
+                if entry[2] is bought_product:
+                    if position == 0:
+                        lots.popleft()
+                    else:
+                        del lots[position]
+                    if not lots:
+                        del lots_by_date[expiration_date]
+                        dates.pop(bisect_left(dates, expiration_date))
+                    break
 
-        for row in reader:
-            if row["product_name"] == product_name:
-                found_products.append(row)
+    def add_sale(self, row):
+        """
+        Writes a sale to the storage and adds it to the in-memory ledger.
+        """
+        self.storage.append_sold([row])
+        self.record_sale(row)
 
-        if not found_products:
-            print(f"ERROR: Product '{product_name}' not in stock.")
-            return
+class CsvStorage:
+    """
+    Stores purchases and sales in 'bought.csv' and 'sold.csv'.
+    Without indexes, most queries read the whole files; period queries use the sell_date index of 'sold.csv'.
+    """
+    name = "csv"
+
+    @timed("io")
+    def load_ledger(self):
+        """
+        Reads all purchases and sales.
+        """
+        return Ledger(read_csv_rows(BOUGHT_FILE), read_csv_rows(SOLD_FILE), self)
+
+    @timed("io")
+    def load_product_ledger(self, product_name):
+        """
+        Reads the purchases of a product and their sales.
+        """
+        return Ledger(read_csv_rows(BOUGHT_FILE), read_csv_rows(SOLD_FILE), self)
+
+    @timed("io")
+    def load_inventory_ledger(self, target_date):
+        """
+        Reads the purchases that are in stock at target_date. The stock is replayed from the nearest stock checkpoint
+        before target_date, so only the sales after that checkpoint are read, using the sell_date index.
+        Without a checkpoint all sales are replayed, which is faster from the cached rows of 'sold.csv' than row by row.
+        """
+        bought = read_csv_rows(BOUGHT_FILE)
+        target = target_date.strftime("%Y-%m-%d")
+        checkpoint_date, in_stock = find_stock_checkpoint(bought, target)
+
+        # Replay the purchases and sales since the checkpoint
+        in_stock = set(in_stock)
+        for row in bought:
+            if row["buy_date"] <= target and (checkpoint_date is None or row["buy_date"] > checkpoint_date):
+                in_stock.add(row["id"])
+        if checkpoint_date is None:
+            sold = [row for row in read_csv_rows(SOLD_FILE) if row["sell_date"] <= target]
+        else:
+            sold = read_sold_rows_in_range(parse_date(checkpoint_date) + timedelta(days=1), target_date)
+        for row in sold:
+            in_stock.discard(row["bought_id"])
+
+        return Ledger([row for row in bought if row["id"] in in_stock], [], self)
+
+    @timed("io")
+    def load_purchase_ledger(self):
+        """
+        Reads all purchases, but no sales. Used by reports that read 'sold.csv' in worker processes (--jobs).
+        """
+        return Ledger(read_csv_rows(BOUGHT_FILE), [], self)
+
+    @timed("io")
+    def load_period_ledger(self, start_date, end_date):
+        """
+        Reads the sales between start_date and end_date (inclusive) using the sell_date index, and all purchases.
+        """
+        return Ledger(read_csv_rows(BOUGHT_FILE), read_sold_rows_in_range(start_date, end_date), self)
+
+    def fingerprint(self):
+        """
+        Returns a value that changes whenever 'bought.csv' or 'sold.csv' is changed.
+        """
+        fingerprint = []
+        for filename in (BOUGHT_FILE, SOLD_FILE):
+            try:
+                status = os.stat(filename)
+                fingerprint.append((status.st_size, status.st_mtime_ns))
+            except FileNotFoundError:
+                fingerprint.append(None)
+        return fingerprint
+
+    @timed("io")
+    def append_bought(self, rows):
+        """
+        Appends purchases to 'bought.csv'.
+        """
+        append_csv_rows(BOUGHT_FILE, BOUGHT_FIELDNAMES, rows)
+
+    @timed("io")
+    def append_sold(self, rows):
+        """
+        Appends sales to 'sold.csv' and adds them to the sell_date index.
+        """
+        append_csv_rows(SOLD_FILE, SOLD_FIELDNAMES, rows)
+        update_sold_index()
+
+    @timed("io")
+    def replace_all(self, ledger):
+        """
+        Overwrites 'bought.csv' and 'sold.csv' with the rows of the given ledger.
+        """
+        write_csv_rows(BOUGHT_FILE, BOUGHT_FIELDNAMES, ledger.bought)
+        write_csv_rows(SOLD_FILE, SOLD_FIELDNAMES, ledger.sold)
+        build_sold_index()
+
+class SqliteStorage:
+    """
+    Stores purchases and sales in an SQLite database, with indexes on product_name, buy_date, sell_date and bought_id.
+    Every query only reads the rows a command needs.
+    """
+    name = "sqlite"
+
+    def __init__(self, filename=DATABASE_FILE):
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(DATABASE_SCHEMA)
+
+    def query(self, sql, parameters=()):
+        """
+        Runs a query and returns the result as a list of dicts, like the rows of csv.DictReader.
+        """
+        cursor = self.connection.execute(sql, parameters)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, values)) for values in cursor]
+        add_to_counter("rows_parsed", len(rows))
+        return rows
+
+    @timed("io")
+    def load_ledger(self):
+        """
+        Reads all purchases and sales.
+        """
+        bought = self.query("SELECT id, product_name, buy_date, buy_price, expiration_date FROM bought ORDER BY rowid")
+        sold = self.query("SELECT id, bought_id, sell_date, sell_price FROM sold ORDER BY rowid")
+        return Ledger(bought, sold, self)
+
+    @timed("io")
+    def load_product_ledger(self, product_name):
+        """
+        Reads the purchases of a product and their sales.
+        """
+        bought = self.query(
+            "SELECT id, product_name, buy_date, buy_price, expiration_date FROM bought "
+            "WHERE product_name = ? ORDER BY rowid",
+            (product_name,),
+        )
+        sold = self.query(
+            "SELECT sold.id, sold.bought_id, sold.sell_date, sold.sell_price FROM sold "
+            "JOIN bought ON bought.id = sold.bought_id WHERE bought.product_name = ? ORDER BY sold.rowid",
+            (product_name,),
+        )
+        return Ledger(bought, sold, self)
+
+    @timed("io")
+    def load_inventory_ledger(self, target_date):
+        """
+        Reads the purchases that are in stock at target_date.
+        """
+        bought = self.query(
+            "SELECT id, product_name, buy_date, buy_price, expiration_date FROM bought "
+            "WHERE buy_date <= :date AND NOT EXISTS "
+            "(SELECT 1 FROM sold WHERE sold.bought_id = bought.id AND sold.sell_date <= :date) ORDER BY rowid",
+            {"date": target_date.strftime("%Y-%m-%d")},
+        )
+        return Ledger(bought, [], self)
+
+    @timed("io")
+    def load_period_ledger(self, start_date, end_date):
+        """
+        Reads the sales between start_date and end_date (inclusive) and the purchases they belong to.
+        """
+        period = (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+        sold = self.query(
+            "SELECT id, bought_id, sell_date, sell_price FROM sold WHERE sell_date BETWEEN ? AND ? ORDER BY rowid",
+            period,
+        )
+        bought = self.query(
+            "SELECT id, product_name, buy_date, buy_price, expiration_date FROM bought "
+            "WHERE id IN (SELECT bought_id FROM sold WHERE sell_date BETWEEN ? AND ?) ORDER BY rowid",
+            period,
+        )
+        return Ledger(bought, sold, self)
+
+    def fingerprint(self):
+        """
+        Returns a value that changes whenever another connection changed the database.
+        """
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def insert_bought(self, rows):
+        """
+        Inserts purchases in the current transaction, without committing it.
+        """
+        self.connection.executemany(
+            "INSERT INTO bought (id, product_name, buy_date, buy_price, expiration_date) "
+            "VALUES (:id, :product_name, :buy_date, :buy_price, :expiration_date)",
+            rows,
+        )
+
+    def insert_sold(self, rows):
+        """
+        Inserts sales in the current transaction, without committing it.
+        """
+        self.connection.executemany(
+            "INSERT INTO sold (id, bought_id, sell_date, sell_price) "
+            "VALUES (:id, :bought_id, :sell_date, :sell_price)",
+            rows,
+        )
+
+    @timed("io")
+    def append_bought(self, rows):
+        """
+        Inserts purchases in a single transaction.
+        """
+        with self.connection:
+            self.insert_bought(rows)
+
+    @timed("io")
+    def append_sold(self, rows):
+        """
+        Inserts sales in a single transaction.
+        """
+        with self.connection:
+            self.insert_sold(rows)
+
+    @timed("io")
+    def replace_all(self, ledger):
+        """
+        Replaces all purchases and sales in the database with the rows of the given ledger, in a single transaction.
+        """
+        # Any failure rolls back the deletes too, so the old rows stay in place
+        with self.connection:
+            self.connection.execute("DELETE FROM bought")
+            self.connection.execute("DELETE FROM sold")
+            self.insert_bought(ledger.bought)
+            self.insert_sold(ledger.sold)
+
+class HotStorage:
+    """
+    Keeps the whole ledger of another storage in memory and answers every query from it.
+    New rows are appended to the other storage and added to the ledger, so it never has to be read again.
+    The ledger itself writes straight to the other storage. Used by 'serve', which reads the ledger again
+    only when another process changed the storage in the meantime.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.name = storage.name
+        self.reload()
+
+    def reload(self):
+        """
+        Reads the ledger from the other storage.
+        """
+        self.ledger = self.storage.load_ledger()
+        self.remember_fingerprint()
+
+    def remember_fingerprint(self):
+        """
+        Remembers the state of the other storage after the server itself changed it.
+        """
+        self.fingerprint = self.storage.fingerprint()
+
+    def refresh(self):
+        """
+        Reads the ledger again if the other storage was changed by someone else since the last remembered state.
+        """
+        if self.storage.fingerprint() != self.fingerprint:
+            self.reload()
+
+    def load_ledger(self):
+        """
+        Returns the ledger in memory.
+        """
+        return self.ledger
+
+    def load_product_ledger(self, product_name):
+        """
+        Returns the ledger in memory.
+        """
+        return self.ledger
+
+    def load_inventory_ledger(self, target_date):
+        """
+        Returns the purchases in memory that are in stock at target_date, like the other storages.
+        """
+        return Ledger(list(iter_inventory_at_date(self.ledger, target_date)), [], self)
+
+    def load_period_ledger(self, start_date, end_date):
+        """
+        Returns the ledger in memory.
+        """
+        return self.ledger
+
+    def append_bought(self, rows):
+        """
+        Appends purchases to the other storage and adds them to the ledger in memory.
+        """
+        self.storage.append_bought(rows)
+        for row in rows:
+            self.ledger.record_purchase(row)
+
+    def append_sold(self, rows):
+        """
+        Appends sales to the other storage and adds them to the ledger in memory.
+        """
+        self.storage.append_sold(rows)
+        for row in rows:
+            self.ledger.record_sale(row)
+
+    def replace_all(self, ledger):
+        """
+        Replaces all rows of the other storage and reads the ledger again.
+        """
+        self.storage.replace_all(ledger)
+        self.reload()
+
+def get_storage(name):
+    """
+    Returns the storage backend with the given name ('csv' or 'sqlite').
+    """
+    if name == "sqlite":
+        return SqliteStorage()
+    return CsvStorage()
 
-        # Check if any of the found products are already sold
-        for found_product in found_products:
-            bought_id = found_product["id"]
-            if not is_product_sold(bought_id):
-                # Check if product is expired
-                expiration_date = datetime.strptime(found_product["expiration_date"], "%Y-%m-%d").date()
-                current_date = get_current_time()
+def read_csv_rows(filename):
+    """
+    Returns all rows of the given CSV file as a list of dicts, or an empty list if the file doesn't exist.
+    The parsed rows are cached next to the file, so only the rows appended since the last read are parsed.
+    """
+    try:
+        csvfile = open(filename, mode="rb")
+    except FileNotFoundError:
+        return []
+
+    with csvfile:
+        status = os.fstat(csvfile.fileno())
+        chunks, cache_end = read_csv_cache(filename)
+        last = chunks[-1] if chunks else None
+
+        # Use the cache as it is if the file hasn't changed since
+        if last is not None and last["inode"] == status.st_ino and last["end"] == status.st_size and last["mtime"] == status.st_mtime_ns:
+            return chunks[0]["rows"] if len(chunks) == 1 else list(itertools.chain.from_iterable(chunk["rows"] for chunk in chunks))
+
+        sample = get_content_sample(csvfile, status.st_size)
+        chunk = {"inode": status.st_ino, "end": status.st_size, "mtime": status.st_mtime_ns, "sample": sample}
+
+        # Rows were only appended if the cached part of the file is still the same, then only the new rows are parsed
+        if (
+            last is not None and last["inode"] == status.st_ino and last["end"] < status.st_size
+            and last["sample"] == get_content_sample(csvfile, last["end"]) and read_byte(csvfile, last["end"] - 1) == b"\n"
+        ):
+            csvfile.seek(last["end"])
+            add_to_counter("bytes_read", status.st_size - last["end"])
+            chunk["fieldnames"] = last["fieldnames"]
+            chunk["rows"] = read_csv_dicts(io.TextIOWrapper(csvfile, newline=""), last["fieldnames"])
+            chunks.append(chunk)
+            if len(chunks) < CACHE_CHUNK_LIMIT:
+                write_csv_cache(filename, chunk, cache_end)
+                return list(itertools.chain.from_iterable(chunk["rows"] for chunk in chunks))
+            chunk["rows"] = list(itertools.chain.from_iterable(chunk["rows"] for chunk in chunks))
+        else:
+            csvfile.seek(0)
+            add_to_counter("bytes_read", status.st_size)
+            lines = io.TextIOWrapper(csvfile, newline="")
+            chunk["fieldnames"] = next(csv.reader(lines), None)
+            if chunk["fieldnames"] is None:
+                return []
+            chunk["rows"] = read_csv_dicts(lines, chunk["fieldnames"])
+
+        write_csv_cache(filename, chunk)
+        return chunk["rows"]
+
+def read_csv_dicts(lines, fieldnames=None):
+    """
+    Parses CSV lines into a list of dicts, with the first line as header unless fieldnames are given.
+    Does the same as list(csv.DictReader(lines)) for well-formed files, but faster.
+    """
+    reader = csv.reader(lines)
+    if fieldnames is None:
+        fieldnames = next(reader, None)
+        if fieldnames is None:
+            return []
+    rows = [dict(zip(fieldnames, values)) for values in reader if values]
+    add_to_counter("rows_parsed", len(rows))
+    return rows
+
+def read_byte(binary_file, offset):
+    """
+    Returns the byte at the given offset of a file opened in binary mode.
+    """
+    binary_file.seek(offset)
+    return binary_file.read(1)
 
-                if expiration_date < current_date:
-                    print(f"ERROR: Product '{product_name}' has expired and cannot be sold.")
-                    return
+def get_content_sample(binary_file, end):
+    """
+    Returns a hash of the first and the last 64 KiB before end. Hashing all of a huge file would take as long as parsing it,
+    so this only notices changes at the start or end of the cached part; files rewritten by SuperPy get a new inode anyway.
+    """
+    block_size = 65536
+    binary_file.seek(0)
+    digest = hashlib.blake2b(binary_file.read(min(block_size, end)))
+    start = max(block_size, end - block_size)
+    binary_file.seek(start)
+    digest.update(binary_file.read(max(0, end - start)))
+    add_to_counter("bytes_read", min(block_size, end) + max(0, end - start))
+    return digest.hexdigest()
+
+def read_csv_cache(filename):
+    """
+    Returns the chunks of rows cached for a CSV file and the offset at which the cache file ends.
+    Every chunk covers the rows up to byte 'end' of the CSV file, starting where the previous chunk ended.
+    A missing cache gives no chunks, and a chunk that was only partly written (or damaged) ends the cache.
+    """
+    chunks = []
+    cache_end = 0
+    try:
+        with open(filename + CACHE_SUFFIX, mode="rb") as cache_file:
+            cache_size = os.fstat(cache_file.fileno()).st_size
+            while True:
+                # Every chunk starts with its length and a hash, so damaged chunks are never unmarshalled
+                header = cache_file.read(24)
+                if len(header) < 24:
+                    break
+                length = int.from_bytes(header[:8], "little")
+                if length > cache_size - cache_end - 24:
+                    break
+                data = cache_file.read(length)
+                if hashlib.blake2b(data, digest_size=16).digest() != header[8:]:
+                    break
+                chunks.append(marshal.loads(data))
+                cache_end = cache_file.tell()
+            add_to_counter("bytes_read", cache_file.tell())
+    except FileNotFoundError:
+        pass
+    return chunks, cache_end
+
+def write_csv_cache(filename, chunk, cache_end=None):
+    """
+    Appends a chunk of rows to the cache of a CSV file at cache_end, cutting off anything after the last complete chunk.
+    Without cache_end, the cache is replaced by the chunk. The cache only saves time, so failing to write it is ignored.
+    """
+    data = marshal.dumps(chunk)
+    data = len(data).to_bytes(8, "little") + hashlib.blake2b(data, digest_size=16).digest() + data
+    try:
+        if cache_end is None:
+            write_file_atomic(filename + CACHE_SUFFIX, data)
+        else:
+            with open(filename + CACHE_SUFFIX, mode="r+b") as cache_file:
+                cache_file.seek(cache_end)
+                cache_file.truncate()
+                cache_file.write(data)
+    except OSError:
+        pass
+
+def append_csv_rows(filename, fieldnames, rows):
+    """
+    Appends rows to the given CSV file in a single write, starting with a header if the file is empty.
+    Returns the byte offset at which every row starts.
+    """
+    line_buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(line_buffer, fieldnames=fieldnames)
+
+    def take_line():
+        line = line_buffer.getvalue()
+        line_buffer.seek(0)
+        line_buffer.truncate()
+        return line
+
+    with open(filename, mode="a", newline="") as csvfile:
+        offset = os.fstat(csvfile.fileno()).st_size
+        chunks = []
+
+        # Write the header if file does not exist or is empty
+        if offset == 0:
+            writer.writeheader()
+            chunks.append(take_line())
+            offset = len(chunks[0].encode())
+
+        # Remember where every row starts, so it can be indexed
+        offsets = []
+        for row in rows:
+            writer.writerow(row)
+            chunks.append(take_line())
+            offsets.append(offset)
+            offset += len(chunks[-1].encode())
+
+        csvfile.write("".join(chunks))
+
+    return offsets
+
+def write_csv_rows(filename, fieldnames, rows):
+    """
+    Overwrites the given CSV file with a header and rows, in one atomic step.
+    """
+    buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+    write_file_atomic(filename, buffer.getvalue())
 
-                # Execute sale
-                sell_date = current_date.strftime("%Y-%m-%d")
+def generate_ids(count, after=0):
+    """
+    Generates count unique ids for new rows. Ids start at the current timestamp, but always count up from the last id
+    handed out (and from after), which is kept in 'last_id.txt'. The file is locked while ids are handed out,
+    so concurrent SuperPy processes never get the same id.
+    """
+    with open(ID_FILE, "a+") as id_file:
+        if fcntl is not None:
+            fcntl.flock(id_file.fileno(), fcntl.LOCK_EX)  # Released when the file is closed
 
-                # Write to sold.csv
-                file_exists = False
-                fieldnames = ["id", "bought_id", "sell_date", "sell_price"]
-                try:
-                    # Try to open file to check if it exists
-                    with open("sold.csv", "r") as csvfile:
-                        reader = csv.DictReader(csvfile)
-                        if reader.fieldnames == fieldnames:
-                            file_exists = True
-                except FileNotFoundError:
-                    pass
+        id_file.seek(0)
+        last_id = id_file.read().strip()
+        first_id = max(int(last_id or 0), after) + 1
+        first_id = max(first_id, int(datetime.now().timestamp()))
 
-                # Open file in the right mode
-                with open("sold.csv", mode="a", newline="") as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        id_file.seek(0)
+        id_file.truncate()
+        id_file.write(str(first_id + count - 1))
 
-                    # Write the header if file does not exist or is empty
-                    if not file_exists:
-                        writer.writeheader()
+    return [str(new_id) for new_id in range(first_id, first_id + count)]
 
-                    # Generate unique ID for sale
-                    sell_id = int(datetime.now().timestamp())
+def select_lot(product_name, ledger, current_date):
+    """
+    Picks the lot to sell for a product: the unsold lot that expires first (first expired, first out), skipping expired lots.
+    Returns the lot and None, or None and an error message.
+    """
+    unsold_lots = ledger.get_unsold_lots(product_name)
 
-                    # Write the data
-                    writer.writerow({
-                        "id": sell_id,
-                        "bought_id": bought_id,
-                        "sell_date": sell_date,
-                        "sell_price": sell_price
-                    })
+    if unsold_lots is None:
+        return None, f"Product '{product_name}' not in stock."
 
-                print(f"OK: Product '{product_name}' (ID: {bought_id}) sold successfully for {sell_price}.")
-                return
+    dates, lots_by_date = unsold_lots
+    if not dates:
+        return None, f"Product '{product_name}' has already been sold."
 
-        print(f"ERROR: Product '{product_name}' has already been sold.")
+    # Dates are sorted, so the first lot of the first date that is today or later is the one to sell
+    position = bisect_left(dates, current_date.isoformat())
+    if position == len(dates):
+        return None, f"Product '{product_name}' has expired and cannot be sold."
 
-def get_inventory_at_date(products, target_date):
+    return lots_by_date[dates[position]][0][2], None
+
+def sell_product(product_name, sell_price, ledger):
     """
-    Retrieves a list of products from 'bought.csv' that are not sold and were bought on or before the target_date.
+    Sells a product by checking if it's in stock, not expired, and not already sold.
+    If conditions are met, records the sale in the ledger's storage.
     """
-    inventory = []
+    current_date = get_current_time()
+
+    lot, error = select_lot(product_name, ledger, current_date)
+    if error:
+        print(f"ERROR: {error}")
+        return
 
-    for product in products:
-        # Check if product is not sold
-        bought_id = product["id"]
-        buy_date = datetime.strptime(product["buy_date"], "%Y-%m-%d").date()
-        
-        if not is_product_sold(bought_id) and buy_date <= target_date:
-            inventory.append(product)
+    # Execute sale
+    bought_id = lot["id"]
+    ledger.add_sale({
+        "id": generate_ids(1)[0],
+        "bought_id": bought_id,
+        "sell_date": current_date.strftime("%Y-%m-%d"),
+        "sell_price": str(sell_price)
+    })
 
-    return inventory
+    print(f"OK: Product '{product_name}' (ID: {bought_id}) sold successfully for {sell_price}.")
 
-def report_inventory(args):
+@timed("parse")
+def read_batch_rows(filename):
     """
-    Generates a Rich-table displaying the inventory at a specified date based on the 'bought.csv' file.
+    Reads the rows of a batch file. The file can be CSV with a header or JSON Lines, and '-' reads from stdin.
+    CSV rows are returned as dicts, JSON Lines as the lines themselves, which parse_batch_row parses one at a time.
     """
-    # Read bought products
-    with open("bought.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        products = list(reader)
+    batch_file = sys.stdin if filename == "-" else open(filename, newline="")
 
-    # Define date by arguments
-    if args.now:
-        current_date = get_current_time()
-    elif args.yesterday:
-        current_date = get_current_time() - timedelta(days=1)
-    elif args.date:
-        current_date = datetime.strptime(args.date, "%Y-%m-%d").date()
-    else:
-        current_date = get_current_time()  # Default naar huidige datum als geen datum is opgegeven
+    with batch_file:
+        first_line = batch_file.readline()
+        lines = itertools.chain([first_line], batch_file)
 
-    # Get relevant inventory
-    inventory = get_inventory_at_date(products, current_date)
+        # JSON Lines files start with an object, everything else is read as CSV
+        if first_line.lstrip().startswith("{"):
+            rows = [line for line in lines if line.strip()]
+            add_to_counter("rows_parsed", len(rows))
+            return rows
+        return read_csv_dicts(lines)
 
-    # Use Rich for better output
-    console = Console()
+def parse_batch_row(row):
+    """
+    Returns a row of read_batch_rows as a dict, parsing it first if it is a JSON line, or raises ValueError.
+    """
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {e}.")
+    if not isinstance(row, dict):
+        raise ValueError(f"Expected a JSON object, got {json.dumps(row)}.")
+    return row
+
+def open_batch_rows(filename):
+    """
+    Returns the rows of a batch file like read_batch_rows, or None after printing an ERROR if the file can't be read.
+    """
+    try:
+        return read_batch_rows(filename)
+    except OSError as e:
+        print(f"ERROR: Can't read {filename}: {e.strerror}.")
+        return None
+
+def parse_batch_price(row):
+    """
+    Returns the price of a batch row as a float, or raises ValueError.
+    """
+    try:
+        return float(row["price"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid price {row.get('price')!r}.")
+
+def buy_products_from_file(filename, storage, current_date):
+    """
+    Buys all products in a batch file. Every row is validated first, and all valid purchases are written in a single append.
+    Prints an OK or ERROR line per row and a summary.
+    """
+    buy_date = current_date.strftime("%Y-%m-%d")
+    batch_rows = open_batch_rows(filename)
+    if batch_rows is None:
+        return
+    new_ids = iter(generate_ids(len(batch_rows)))
+
+    purchases = []
+    results = []
+    for row_number, row in enumerate(batch_rows, start=1):
+        try:
+            row = parse_batch_row(row)
+            product_name = row.get("product_name")
+            if not product_name:
+                raise ValueError("Missing product_name.")
+            buy_price = parse_batch_price(row)
+            expiration_date = str(row.get("expiration_date"))
+            try:
+                if len(expiration_date) != 10:
+                    raise ValueError
+                parse_date(expiration_date)
+            except ValueError:
+                raise ValueError(f"Invalid expiration_date {expiration_date!r}, use the format YYYY-MM-DD.")
+        except ValueError as e:
+            results.append(f"ERROR: Row {row_number}: {e}")
+            continue
+
+        product_id = next(new_ids)
+        purchases.append({
+            "id": product_id,
+            "product_name": product_name,
+            "buy_date": buy_date,
+            "buy_price": str(buy_price),
+            "expiration_date": expiration_date
+        })
+        results.append(f"OK: Row {row_number}: Product '{product_name}' (ID: {product_id}) bought for {buy_price}.")
+
+    storage.append_bought(purchases)
+    print_batch_results(results, len(purchases))
+
+def sell_products_from_file(filename, ledger, current_date):
+    """
+    Sells all products in a batch file against the in-memory ledger, picking lots first expired, first out.
+    All successful sales are written in a single append. Prints an OK or ERROR line per row and a summary.
+    """
+    sell_date = current_date.strftime("%Y-%m-%d")
+    batch_rows = open_batch_rows(filename)
+    if batch_rows is None:
+        return
+    new_ids = iter(generate_ids(len(batch_rows)))
+
+    sales = []
+    results = []
+    for row_number, row in enumerate(batch_rows, start=1):
+        try:
+            row = parse_batch_row(row)
+            product_name = row.get("product_name")
+            sell_price = parse_batch_price(row)
+        except ValueError as e:
+            results.append(f"ERROR: Row {row_number}: {e}")
+            continue
+
+        lot, error = select_lot(product_name, ledger, current_date)
+        if error:
+            results.append(f"ERROR: Row {row_number}: {error}")
+            continue
+
+        sale = {
+            "id": next(new_ids),
+            "bought_id": lot["id"],
+            "sell_date": sell_date,
+            "sell_price": str(sell_price)
+        }
+        ledger.record_sale(sale)
+        sales.append(sale)
+        results.append(f"OK: Row {row_number}: Product '{product_name}' (ID: {lot['id']}) sold successfully for {sell_price}.")
+
+    ledger.storage.append_sold(sales)
+    print_batch_results(results, len(sales))
+
+def print_batch_results(results, succeeded):
+    """
+    Prints the result lines of a batch in a single write, followed by a summary.
+    """
+    if results:
+        sys.stdout.write("\n".join(results) + "\n")
+    print(f"Processed {len(results)} rows: {succeeded} succeeded, {len(results) - succeeded} failed.")
+
+def find_duplicate_ids(rows):
+    """
+    Returns the ids that occur more than once in rows, with the number of times they occur.
+    """
+    counts = Counter(row["id"] for row in rows)
+    return {row_id: count for row_id, count in counts.items() if count > 1}
 
-    if not inventory:
-        console.print(f"No inventory at {current_date.strftime('%Y-%m-%d')}.")
+def repair_duplicate_ids(ledger):
+    """
+    Gives every row with a repeated id a new unique id, keeping the first row with that id as it is.
+    Sales of a repeated purchase id are spread over those purchases in order: the first sale stays with the first purchase,
+    the second sale moves to the second purchase, and so on. Returns the number of rows that got a new id.
+    """
+    duplicate_bought = find_duplicate_ids(ledger.bought)
+    duplicate_sold = find_duplicate_ids(ledger.sold)
+    repaired = sum(duplicate_bought.values()) - len(duplicate_bought) + sum(duplicate_sold.values()) - len(duplicate_sold)
+
+    # New ids have to be higher than every id in use
+    highest_id = max((int(row["id"]) for row in ledger.bought + ledger.sold if row["id"].isdigit()), default=0)
+    new_ids = iter(generate_ids(repaired, after=highest_id))
+
+    # Rename repeated purchases and remember all ids each old id now stands for
+    renamed_bought = {}
+    for row in ledger.bought:
+        old_id = row["id"]
+        if old_id in duplicate_bought:
+            bought_ids = renamed_bought.setdefault(old_id, [])
+            if bought_ids:
+                row["id"] = next(new_ids)
+            bought_ids.append(row["id"])
+
+    seen_sold_ids = set()
+    sales_per_bought_id = Counter()
+    for row in ledger.sold:
+        # Move sales of a repeated purchase to the next purchase with that id
+        bought_ids = renamed_bought.get(row["bought_id"])
+        if bought_ids:
+            sale_number = sales_per_bought_id[row["bought_id"]]
+            sales_per_bought_id[row["bought_id"]] += 1
+            if sale_number < len(bought_ids):
+                row["bought_id"] = bought_ids[sale_number]
+
+        # Rename repeated sales
+        if row["id"] in seen_sold_ids:
+            row["id"] = next(new_ids)
+        seen_sold_ids.add(row["id"])
+
+    return repaired
+
+def check_ids(storage, repair):
+    """
+    Reports repeated ids in the purchases and sales of the storage, and repairs them if asked to.
+    """
+    ledger = storage.load_ledger()
+    duplicate_bought = find_duplicate_ids(ledger.bought)
+    duplicate_sold = find_duplicate_ids(ledger.sold)
+
+    if not duplicate_bought and not duplicate_sold:
+        print("OK: All ids are unique.")
+        return
+
+    for kind, duplicates in (("purchase", duplicate_bought), ("sale", duplicate_sold)):
+        for row_id, count in duplicates.items():
+            print(f"ERROR: {count} {kind}s share the id {row_id}.")
+
+    if repair:
+        repaired = repair_duplicate_ids(ledger)
+        storage.replace_all(ledger)
+        print(f"OK: Gave {repaired} rows a new id.")
     else:
-        table = Table(show_header=True, header_style="bold magenta")
-        table.add_column("Product Name", style="dim", width=15)
-        table.add_column("Count", justify="center", style="dim")
-        table.add_column("Buy Price", justify="center", style="dim")
-        table.add_column("Expiration Date", style="dim")
-        table.add_column("Buy Date", style="dim")
+        print("Run again with --repair to give the repeated rows new ids.")
 
-        for product in inventory:
-            product_name = product["product_name"]
-            buy_price = product["buy_price"]
-            expiration_date = product["expiration_date"]
-            buy_date = product["buy_date"]
+def read_line_end(csvfile, offset):
+    """
+    Returns the byte offset right after the row that starts at offset in an opened binary file, or None if there is no row.
+    """
+    csvfile.seek(offset)
+    line = csvfile.readline()
+    if not line.endswith(b"\n"):
+        return None
+    return csvfile.tell()
 
-            table.add_row(product_name, "1", buy_price, expiration_date, buy_date)
+def index_sold_rows(csvfile, offset, entries):
+    """
+    Adds a (sell_date, offset) entry to entries for every row in the opened binary 'sold.csv' from offset on.
+    Returns the offset right after the last complete row.
+    """
+    csvfile.seek(0)
+    header = csvfile.readline().decode().strip().split(",")
+    date_column = header.index("sell_date")
+
+    csvfile.seek(offset)
+    start = offset
+    for line in iter(csvfile.readline, b""):
+        if not line.endswith(b"\n"):
+            break  # Row is still being written
+        entries.append((line.decode().rstrip("\r\n").split(",")[date_column], offset))
+        offset += len(line)
+    add_to_counter("bytes_read", offset - start)
+    return offset
+
+def format_sold_index_record(key, offset):
+    """
+    Returns a line of the sell_date index. Every line has the same length, so the index can be bisected by seeking.
+    """
+    return f"{key[:10]:<10},{offset:012d}\n".encode()
 
-        console.print(table)
+def format_sold_index_header(indexed_end, inode, mtime, sample):
+    """
+    Returns the header of the sell_date index: the offset up to which 'sold.csv' is indexed, and the inode, mtime and
+    content sample of 'sold.csv' at that point, padded to SOLD_INDEX_HEADER_LINES lines.
+    """
+    header = f"indexed,{indexed_end},{inode},{mtime},{sample}"
+    return header.ljust(SOLD_INDEX_HEADER_LINES * SOLD_INDEX_RECORD_SIZE - 1).encode() + b"\n"
 
-def get_sold_products_on_date(target_date):
+def read_sold_index_header(index_file):
     """
-    Retrieves a list of products sold on a specific target_date from 'sold.csv'.
+    Returns the indexed end, inode, mtime and content sample in the header of the opened binary index, or None if it is broken.
     """
-    sold_products = []
+    index_file.seek(0)
+    header = index_file.read(SOLD_INDEX_HEADER_LINES * SOLD_INDEX_RECORD_SIZE)
+    add_to_counter("bytes_read", len(header))
+    try:
+        key, indexed_end, inode, mtime, sample = header.decode().rstrip().split(",")
+        if key != "indexed":
+            return None
+        return {"end": int(indexed_end), "inode": int(inode), "mtime": int(mtime), "sample": sample}
+    except ValueError:
+        return None
+
+def build_sold_index():
+    """
+    Rebuilds the sidecar index of 'sold.csv' from scratch. The index maps every sell_date to the byte offsets of its rows,
+    sorted by date, after a header with the state of 'sold.csv' it was built from. Returns the number of indexed rows.
+    """
+    entries = []
+    indexed_end = inode = mtime = 0
+    sample = ""
+    try:
+        with open(SOLD_FILE, mode="rb") as csvfile:
+            status = os.fstat(csvfile.fileno())
+            inode, mtime = status.st_ino, status.st_mtime_ns
+            csvfile.readline()  # Skip header
+            indexed_end = index_sold_rows(csvfile, csvfile.tell(), entries)
+            sample = get_content_sample(csvfile, indexed_end)
+    except FileNotFoundError:
+        pass
 
-    with open("sold.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            sell_date = datetime.strptime(row["sell_date"], "%Y-%m-%d").date()
+    entries.sort()
+    records = [format_sold_index_header(indexed_end, inode, mtime, sample)]
+    records.extend(format_sold_index_record(sell_date, offset) for sell_date, offset in entries)
+    write_file_atomic(SOLD_INDEX_FILE, b"".join(records))
 
-            if sell_date == target_date:
-                sold_products.append(row)
+    return len(entries)
 
-    return sold_products
+def read_sold_index_record(index_file, position):
+    """
+    Returns the key and offset of the index line at position (0 is the first line after the header) of the opened binary index.
+    """
+    index_file.seek((SOLD_INDEX_HEADER_LINES + position) * SOLD_INDEX_RECORD_SIZE)
+    record = index_file.read(SOLD_INDEX_RECORD_SIZE)
+    add_to_counter("bytes_read", len(record))
+    return record[:10].decode().rstrip(), int(record[11:23])
 
-def get_sold_products_in_period(end_date):
+def update_sold_index():
     """
-    Retrieves a list of products sold within a specific period until the end_date from 'sold.csv'.
+    Indexes the rows appended to 'sold.csv' since the index was last written. They are appended to the index when they
+    don't go before its last date, which is the usual case; a missing, broken or outdated index is rebuilt.
     """
-    sold_products = []
+    try:
+        index_file = open(SOLD_INDEX_FILE, mode="r+b")
+    except FileNotFoundError:
+        build_sold_index()
+        return
+
+    with index_file:
+        index_size = os.fstat(index_file.fileno()).st_size
+        records = index_size // SOLD_INDEX_RECORD_SIZE - SOLD_INDEX_HEADER_LINES
+        header = read_sold_index_header(index_file)
+        try:
+            last = read_sold_index_record(index_file, records - 1) if records > 0 else None
+        except ValueError:
+            header = None
 
-    with open("sold.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            sell_date = datetime.strptime(row["sell_date"], "%Y-%m-%d").date()
+        try:
+            with open(SOLD_FILE, mode="rb") as csvfile:
+                status = os.fstat(csvfile.fileno())
+
+                # Rows indexed after the header was written (an interrupted update), or a rewritten 'sold.csv',
+                # mean the index doesn't match anymore
+                if (
+                    header is None or records < 0 or index_size % SOLD_INDEX_RECORD_SIZE != 0
+                    or header["inode"] != status.st_ino or header["end"] > status.st_size
+                    or (last is not None and (last[1] >= header["end"] or read_line_end(csvfile, last[1]) is None))
+                ):
+                    build_sold_index()
+                    return
+                if header["end"] == status.st_size and header["mtime"] == status.st_mtime_ns:
+                    return
+
+                # Appending makes the file longer and keeps the indexed part; anything else was an edit by hand
+                if header["end"] == status.st_size or get_content_sample(csvfile, header["end"]) != header["sample"]:
+                    build_sold_index()
+                    return
+
+                entries = []
+                indexed_end = index_sold_rows(csvfile, header["end"], entries)
+                sample = get_content_sample(csvfile, indexed_end)
+        except FileNotFoundError:
+            if header is None or header["inode"] != 0:
+                build_sold_index()
+            return
 
-            if sell_date == end_date:
-                sold_products.append(row)
+        # Rows sold on an earlier date than the last indexed row need a new, sorted index
+        if any(entries[i][0] > entries[i + 1][0] for i in range(len(entries) - 1)) or (last is not None and entries and entries[0][0] < last[0]):
+            build_sold_index()
+            return
 
-    return sold_products
+        # Append the entries before moving the indexed end, so an interrupted update is noticed and rebuilt
+        index_file.seek(0, os.SEEK_END)
+        index_file.write(b"".join(format_sold_index_record(sell_date, offset) for sell_date, offset in entries))
+        index_file.flush()
+        index_file.seek(0)
+        index_file.write(format_sold_index_header(indexed_end, status.st_ino, status.st_mtime_ns, sample))
 
-def get_date_range_description(end_date):
+def find_sold_index_position(index_file, records, sell_date, after=False):
     """
-    Returns a formatted string description for a given end_date, typically used for displaying in reports.
+    Bisects the opened binary index for the first line dated on sell_date or later (after it, with after), by seeking,
+    so only about log2(records) lines are read. Returns a position from 0 (the first line after the header) to records.
     """
-    return f"{end_date.year}" if end_date.day == 1 and end_date.month == 1 else end_date.strftime('%Y-%m-%d')
+    low, high = 0, records
+    while low < high:
+        middle = (low + high) // 2
+        key = read_sold_index_record(index_file, middle)[0]
+        if key < sell_date or (after and key == sell_date):
+            low = middle + 1
+        else:
+            high = middle
+    return low
 
-def get_sold_products_in_month(target_month):
+def read_sold_rows_in_range(start_date, end_date):
     """
-    Retrieves a list of products sold in a specific target_month from 'sold.csv'.
+    Reads only the rows of 'sold.csv' sold between start_date and end_date (inclusive) by seeking to the offsets in the index.
+    Rows are returned in file order.
     """
-    sold_products = []
+    update_sold_index()
 
-    with open("sold.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            sell_date = datetime.strptime(row["sell_date"], "%Y-%m-%d").date()
+    # Find the slice of the index for the period, and read only that slice
+    try:
+        with open(SOLD_INDEX_FILE, mode="rb") as index_file:
+            records = os.fstat(index_file.fileno()).st_size // SOLD_INDEX_RECORD_SIZE - SOLD_INDEX_HEADER_LINES
+            first = find_sold_index_position(index_file, records, start_date.strftime("%Y-%m-%d"))
+            last = find_sold_index_position(index_file, records, end_date.strftime("%Y-%m-%d"), after=True)
+            index_file.seek((SOLD_INDEX_HEADER_LINES + first) * SOLD_INDEX_RECORD_SIZE)
+            data = index_file.read(max(0, last - first) * SOLD_INDEX_RECORD_SIZE)
+    except FileNotFoundError:
+        return []
+    add_to_counter("bytes_read", len(data))
+    offsets = sorted(int(data[start + 11:start + 23]) for start in range(0, len(data), SOLD_INDEX_RECORD_SIZE))
+    if not offsets:
+        return []
+
+    rows = []
+    bytes_read = 0
+    with open(SOLD_FILE, mode="rb") as csvfile:
+        fieldnames = csvfile.readline().decode().strip().split(",")
+        for offset in offsets:
+            csvfile.seek(offset)
+            line = csvfile.readline()
+            bytes_read += len(line)
+            values = next(csv.reader([line.decode()]))
+            rows.append(dict(zip(fieldnames, values)))
+    add_to_counter("bytes_read", bytes_read)
+    add_to_counter("rows_parsed", len(rows))
+    return rows
+
+def get_file_signature(filename):
+    """
+    Returns the inode, size, mtime and content sample of a file, or None if it doesn't exist.
+    Appending keeps the inode, rewriting a file doesn't.
+    """
+    try:
+        signed_file = open(filename, mode="rb")
+    except FileNotFoundError:
+        return None
+    with signed_file:
+        status = os.fstat(signed_file.fileno())
+        return [status.st_ino, status.st_size, status.st_mtime_ns, get_content_sample(signed_file, status.st_size)]
 
-            if sell_date.year == target_month.year and sell_date.month == target_month.month:
-                sold_products.append(row)
+def is_only_appended(filename, signature):
+    """
+    Returns whether rows were only appended to a file since get_file_signature gave signature, with the same checks
+    as the parse cache: the same inode and the same content sample up to the signed size, or the same mtime at that size.
+    """
+    try:
+        signed_file = open(filename, mode="rb")
+    except FileNotFoundError:
+        return signature is None
+    if signature is None or len(signature) != 4:
+        return False
+
+    with signed_file:
+        status = os.fstat(signed_file.fileno())
+        inode, size, mtime, sample = signature
+        if status.st_ino != inode or status.st_size < size:
+            return False
+        if status.st_size == size:
+            return status.st_mtime_ns == mtime
+        return get_content_sample(signed_file, size) == sample
+
+def build_stock_checkpoints(ledger, every):
+    """
+    Replays all purchases and sales in date order and saves the stock at the end of every day or month
+    to 'stock_checkpoints.json', together with the state of 'bought.csv' and 'sold.csv' it was built from.
+    Returns the number of checkpoints.
+    """
+    # Purchases go before sales on the same day
+    events = [(row["buy_date"], 0, row["id"]) for row in ledger.bought]
+    events += [(row["sell_date"], 1, row["bought_id"]) for row in ledger.sold]
+    events.sort()
+
+    def period_end(event_date):
+        if every == "day":
+            return event_date
+        # Last day of the month
+        first_day = parse_date(event_date[:7] + "-01")
+        return ((first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    checkpoints = []
+    in_stock = set()
+    for index, (event_date, kind, bought_id) in enumerate(events):
+        if kind == 0:
+            in_stock.add(bought_id)
+        else:
+            in_stock.discard(bought_id)
+
+        # Save the stock after the last event of every period
+        checkpoint_date = period_end(event_date)
+        if index + 1 == len(events) or period_end(events[index + 1][0]) != checkpoint_date:
+            checkpoints.append([checkpoint_date, sorted(in_stock)])
+
+    write_file_atomic(CHECKPOINT_FILE, json.dumps({
+        "every": every,
+        "bought": get_file_signature(BOUGHT_FILE),
+        "bought_rows": len(ledger.bought),
+        "sold": get_file_signature(SOLD_FILE),
+        "checkpoints": checkpoints,
+    }))
+    return len(checkpoints)
+
+def find_stock_checkpoint(bought, target):
+    """
+    Returns the date and stock of the latest saved checkpoint on or before the target date that is still valid, or None and an empty list.
+    Checkpoints are invalid when 'bought.csv' or 'sold.csv' was rewritten or edited, or when rows dated on or before them were appended since.
+    """
+    try:
+        with open(CHECKPOINT_FILE, "r") as checkpoint_file:
+            saved = json.load(checkpoint_file)
+    except (FileNotFoundError, ValueError):
+        return None, []
+
+    # Only appending keeps the checkpoints usable. Outdated checkpoints are removed, so rows appended after an edit
+    # can't make them look valid again
+    if not is_only_appended(BOUGHT_FILE, saved["bought"]) or not is_only_appended(SOLD_FILE, saved["sold"]):
+        try:
+            os.remove(CHECKPOINT_FILE)
+        except FileNotFoundError:
+            pass
+        return None, []
+
+    # Appended rows change the stock from their date on
+    appended_dates = [row["buy_date"] for row in bought[saved["bought_rows"]:]]
+    if saved["sold"] is not None:
+        with open(SOLD_FILE, mode="rb") as csvfile:
+            appended_sales = []
+            index_sold_rows(csvfile, saved["sold"][1], appended_sales)
+        appended_dates += [sell_date for sell_date, offset in appended_sales]
+    earliest_change = min(appended_dates, default=None)
+
+    for checkpoint_date, in_stock in reversed(saved["checkpoints"]):
+        if checkpoint_date <= target and (earliest_change is None or checkpoint_date < earliest_change):
+            return checkpoint_date, in_stock
+    return None, []
+
+def get_archive_filenames(year):
+    """
+    Returns the filenames of the archived purchases and sales of a year (format: YYYY).
+    """
+    return os.path.join(ARCHIVE_DIRECTORY, f"bought-{year}.csv"), os.path.join(ARCHIVE_DIRECTORY, f"sold-{year}.csv")
+
+def compact(storage, before_year):
+    """
+    Moves the lots sold before the first day of before_year, and the sales before that day, into per-year archive files,
+    and keeps only the rest in the storage. A lot is archived in the year it was sold. Returns the number of archived
+    purchases and sales.
+    """
+    cutoff = f"{before_year:04d}-01-01"
+    ledger = storage.load_ledger()
+
+    archived_bought = {}
+    archived_sold = {}
+    hot_bought = []
+    hot_sold = []
+
+    # Unsold lots stay, also when they have expired: they are in stock at every later date, and can still be sold
+    for row in ledger.bought:
+        sell_date = ledger.sell_dates.get(row["id"])
+        if sell_date is not None and sell_date < cutoff:
+            archived_bought.setdefault(sell_date[:4], []).append(row)
+        else:
+            hot_bought.append(row)
+
+    # A sale before the cutoff closes its lot before the cutoff, so every sale goes to the same year as its lot
+    for row in ledger.sold:
+        if row["sell_date"] < cutoff:
+            archived_sold.setdefault(row["sell_date"][:4], []).append(row)
+        else:
+            hot_sold.append(row)
+
+    if not archived_bought and not archived_sold:
+        return 0, 0
+
+    # Write the archives before the storage, so a crash leaves rows in both places instead of in neither.
+    # Rows that are already archived (after such a crash) are not archived twice.
+    os.makedirs(ARCHIVE_DIRECTORY, exist_ok=True)
+    for year in sorted(set(archived_bought) | set(archived_sold)):
+        for filename, fieldnames, rows in zip(get_archive_filenames(year), (BOUGHT_FIELDNAMES, SOLD_FIELDNAMES), (archived_bought.get(year, []), archived_sold.get(year, []))):
+            archived_ids = {row["id"] for row in read_csv_rows(filename)}
+            append_csv_rows(filename, fieldnames, [row for row in rows if row["id"] not in archived_ids])
+
+    build_archive_rollup(cutoff)
+    storage.replace_all(Ledger(hot_bought, hot_sold, storage))
 
-    return sold_products
+    return len(ledger.bought) - len(hot_bought), len(ledger.sold) - len(hot_sold)
 
-def get_sold_products_in_year(target_year):
+def build_archive_rollup(cutoff):
     """
-    Retrieves a list of products sold in a specific target_year from 'sold.csv'.
+    Adds up the revenue, profit and count of all archived sales per day, month and year, exactly like merge_sales,
+    and saves them to the rollup file together with the date before which all sales are archived.
     """
-    sold_products = []
+    rollup = load_archive_rollup() or {"before": cutoff}
+    rollup = {"before": max(rollup["before"], cutoff), "day": {}, "month": {}, "year": {}}
 
-    with open("sold.csv", mode="r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            sell_date = datetime.strptime(row["sell_date"], "%Y-%m-%d").date()
+    for filename in sorted(os.listdir(ARCHIVE_DIRECTORY)):
+        if filename.startswith("sold-") and filename.endswith(".csv"):
+            bought_file, sold_file = get_archive_filenames(filename[5:-4])
+            ledger = Ledger(read_csv_rows(bought_file), read_csv_rows(sold_file), None)
+            aggregate = merge_sales(iter_sales(ledger, date.min, date.max), keep_sales=False)
+            for breakdown in ("day", "month", "year"):
+                rollup[breakdown].update(aggregate[breakdown])
 
-            if sell_date.year == target_year.year:
-                sold_products.append(row)
+    write_file_atomic(ROLLUP_FILE, json.dumps(rollup))
 
-    return sold_products
+def load_archive_rollup():
+    """
+    Returns the rollup of the archived sales, or None if nothing has been archived.
+    """
+    try:
+        with open(ROLLUP_FILE, "r") as rollup_file:
+            return json.load(rollup_file)
+    except (FileNotFoundError, ValueError):
+        return None
 
-def report_revenue(args):
+def iter_archived_sales(start_date, end_date):
     """
-    Generates revenue reports based on specified time periods and displays the results using matplotlib.
+    Yields the archived sales between start_date and end_date (inclusive) like iter_sales, reading only the archives of those years.
+    """
+    for year in range(start_date.year, end_date.year + 1):
+        bought_file, sold_file = get_archive_filenames(f"{year:04d}")
+        yield from iter_sales(Ledger(read_csv_rows(bought_file), read_csv_rows(sold_file), None), start_date, end_date)
+
+def aggregate_archived_sales(rollup, start_date, end_date, keep_sales=True):
+    """
+    Answers aggregate_period_sales for a day, month or year before the archive cutoff from the rollup, without reading any sales.
+    Only with keep_sales, the individual sales are read from the archives of the period.
+    """
+    start = start_date.strftime("%Y-%m-%d")
+    end = end_date.strftime("%Y-%m-%d")
+
+    # Report periods are a single day, month or year, which is a single rollup
+    if start == end:
+        totals = rollup["day"].get(start)
+    elif start[:7] == end[:7]:
+        totals = rollup["month"].get(start[:7])
+    else:
+        totals = rollup["year"].get(start[:4])
+
+    return {
+        "sales": list(iter_archived_sales(start_date, end_date)) if keep_sales else [],
+        "total": totals or new_rollup(),
+        "day": {day: values for day, values in rollup["day"].items() if start <= day <= end},
+        "month": {month: values for month, values in rollup["month"].items() if start[:7] <= month <= end[:7]},
+        "year": {year: values for year, values in rollup["year"].items() if start[:4] <= year <= end[:4]},
+    }
+
+def load_archived_inventory_ledger(target_date):
+    """
+    Returns a ledger of the archived purchases that were in stock at target_date, in id order, or None if target_date is
+    not before the archive cutoff. Only lots sold before the cutoff are archived, so only earlier dates need the archives.
+    """
+    rollup = load_archive_rollup()
+    if rollup is None or target_date.strftime("%Y-%m-%d") >= rollup["before"]:
+        return None
+
+    bought = []
+    sold = []
+    with timed("io"):
+        for filename in sorted(os.listdir(ARCHIVE_DIRECTORY)):
+            if filename.startswith("bought-") and filename.endswith(".csv"):
+                bought_file, sold_file = get_archive_filenames(filename[7:-4])
+                bought.extend(read_csv_rows(bought_file))
+                sold.extend(read_csv_rows(sold_file))
+
+    # The archives are split by the year lots were sold in, not bought in
+    in_stock = sorted(iter_inventory_at_date(Ledger(bought, sold, None), target_date), key=lambda lot: int(lot["id"]))
+    return Ledger(in_stock, [], None)
+
+def iter_inventory_at_date(ledger, target_date):
+    """
+    Yields the products from 'bought.csv' that were bought on or before the target_date and not sold yet at that date, one at a time.
+    """
+    # Dates are stored as YYYY-MM-DD, so they can be compared as text
+    target = target_date.strftime("%Y-%m-%d")
+
+    for product in ledger.bought:
+        # Check if product is not sold (yet)
+        sell_date = ledger.sell_dates.get(product["id"])
+        if product["buy_date"] <= target and (sell_date is None or sell_date > target):
+            yield product
+
+def group_inventory(inventory):
+    """
+    Aggregates lots per product in a single pass: count, total and average cost, and the nearest expiration date.
+    Returns the groups sorted by product name.
+    """
+    groups = {}
+
+    for product in inventory:
+        group = groups.get(product["product_name"])
+        if group is None:
+            group = groups[product["product_name"]] = {
+                "product_name": product["product_name"],
+                "count": 0,
+                "total_cost": 0.0,
+                "nearest_expiration_date": product["expiration_date"],
+            }
+
+        group["count"] += 1
+        group["total_cost"] += float(product["buy_price"])
+        group["nearest_expiration_date"] = min(group["nearest_expiration_date"], product["expiration_date"])
+
+    for group in groups.values():
+        group["average_cost"] = group["total_cost"] / group["count"]
+
+    return [groups[product_name] for product_name in sorted(groups)]
+
+def iter_inventory_table(inventory, groups=None):
+    """
+    Returns the column names for an inventory table and a generator of its rows as strings.
+    Given the groups of group_inventory, the table has one row per product instead of one per lot.
+    """
+    if groups is not None:
+        columns = ["Product Name", "Count", "Total Cost", "Average Cost", "Nearest Expiry"]
+        rows = (
+            [group["product_name"], str(group["count"]), f"{group['total_cost']:.2f}", f"{group['average_cost']:.2f}", group["nearest_expiration_date"]]
+            for group in groups
+        )
+    else:
+        columns = ["Product Name", "Count", "Buy Price", "Expiration Date", "Buy Date"]
+        rows = (
+            [product["product_name"], "1", product["buy_price"], product["expiration_date"], product["buy_date"]]
+            for product in inventory
+        )
+    return columns, rows
+
+def stream_table(columns, rows):
+    """
+    Writes a plain text table row by row as the rows come in, without holding them in memory.
+    Returns the number of rows written.
+    """
+    width = 16
+    sys.stdout.write("".join(column.ljust(width) for column in columns).rstrip() + "\n")
+
+    count = 0
+    for row in rows:
+        sys.stdout.write("".join(str(value).ljust(width) for value in row).rstrip() + "\n")
+        count += 1
+    return count
+
+def report_inventory(args, storage):
+    """
+    Generates a Rich-table displaying the inventory at a specified date based on the 'bought.csv' file.
+    With --group the lots are aggregated per product, and with --stream the table is written as plain text while it is computed.
+    With --format json, jsonl or csv the lots (or groups) are written for other programs instead, also while they are computed.
     """
     # Define date by arguments
+    if args.now:
+        current_date = get_current_time()
+    elif args.yesterday:
+        current_date = get_current_time() - timedelta(days=1)
+    elif args.date:
+        current_date = parse_date(args.date, "%Y-%m-%d")
+    else:
+        current_date = get_current_time()  # Default naar huidige datum als geen datum is opgegeven
+
+    # Get relevant inventory; before the archive cutoff (see 'compact') the archived lots are added row by row
+    archived = load_archived_inventory_ledger(current_date)
+    if args.columnar and archived is None:
+        columnar = load_columnar_ledger(storage, lambda: storage.load_inventory_ledger(current_date))
+        inventory = columnar.iter_inventory_at_date(current_date)
+        groups = columnar.group_inventory_at_date(current_date) if args.group else None
+    else:
+        ledger = storage.load_inventory_ledger(current_date)
+        inventory = iter_inventory_at_date(ledger, current_date)
+        if archived is not None:
+            # Ids are handed out in order, so merging by id keeps the order (and sums) from before compacting
+            inventory = heapq.merge(archived.bought, inventory, key=lambda lot: int(lot["id"]))
+        groups = group_inventory(inventory) if args.group else None
+    # Write the lots or groups for other programs as they are computed
+    if args.format != "table":
+        with timed("render"):
+            if groups is not None:
+                write_records(groups, ["product_name", "count", "total_cost", "average_cost", "nearest_expiration_date"], args.format)
+            else:
+                records = (dict(lot, buy_price=float(lot["buy_price"])) for lot in inventory)
+                write_records(records, BOUGHT_FIELDNAMES, args.format)
+        return
+
+    columns, rows = iter_inventory_table(inventory, groups)
+
+    # Write huge inventories as they are computed
+    if args.stream:
+        with timed("render"):
+            if stream_table(columns, rows) == 0:
+                print(f"No inventory at {current_date.strftime('%Y-%m-%d')}.")
+        return
+
+    # Use Rich for better output
+    Console, Table = import_rich()
+
+    with timed("render"):
+        console = Console()
+        rows = list(rows)
+
+        if not rows:
+            console.print(f"No inventory at {current_date.strftime('%Y-%m-%d')}.")
+        else:
+            table = Table(show_header=True, header_style="bold magenta")
+            table.add_column(columns[0], style="dim", width=15)
+            table.add_column(columns[1], justify="center", style="dim")
+            table.add_column(columns[2], justify="center", style="dim")
+            for column in columns[3:]:
+                table.add_column(column, style="dim")
+
+            for row in rows:
+                table.add_row(*row)
+
+            console.print(table)
+
+def iter_expiring_lots(ledger, until):
+    """
+    Yields the unsold lots of all products that expire on or before a date (format: YYYY-MM-DD), the first to expire first.
+    The lots come from the expiration index of the ledger, so only the lots that are reported are looked at.
+    """
+    products = ledger.index_unsold_lots()
+    for expiration_date, position, lot in heapq.merge(*(ledger.iter_unsold_lots(product_name) for product_name in products)):
+        if expiration_date > until:
+            return
+        yield lot
+
+def report_expiring(args, storage):
+    """
+    Generates a Rich-table of the products in stock that expire within the given number of days, including expired ones.
+    """
+    current_date = get_current_time()
+    until = current_date + timedelta(days=args.within)
+
+    # Get the lots in stock today, sorted by expiration date
+    ledger = storage.load_inventory_ledger(current_date)
+    lots = iter_expiring_lots(ledger, until.isoformat())
+    archived = load_archived_inventory_ledger(current_date)
+    if archived is not None:
+        lots = heapq.merge(iter_expiring_lots(archived, until.isoformat()), lots, key=lambda lot: lot["expiration_date"])
+
+    # Use Rich for better output
+    Console, Table = import_rich()
+
+    with timed("render"):
+        console = Console()
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Product Name", style="dim", width=15)
+        table.add_column("Buy Price", justify="center", style="dim")
+        table.add_column("Expiration Date", justify="center", style="dim")
+        table.add_column("Days Left", justify="right", style="dim")
+
+        for lot in lots:
+            days_left = (parse_date(lot["expiration_date"]) - current_date).days
+            table.add_row(lot["product_name"], lot["buy_price"], lot["expiration_date"], str(days_left) if days_left >= 0 else "Expired")
+
+        if table.row_count == 0:
+            console.print(f"No products expire on or before {until.strftime('%Y-%m-%d')}.")
+        else:
+            console.print(table)
+
+def get_report_period(args):
+    """
+    Translates the period arguments of a report command into an inclusive (start_date, end_date) range and a description.
+    """
     if args.today:
         target_date = get_current_time()
+        return target_date, target_date, target_date.strftime("%Y-%m-%d")
     elif args.yesterday:
         target_date = get_current_time() - timedelta(days=1)
+        return target_date, target_date, target_date.strftime("%Y-%m-%d")
     elif args.date:
-        target_date = datetime.strptime(args.date, "%Y-%m-%d").date()
+        target_date = parse_date(args.date, "%Y-%m-%d")
+        return target_date, target_date, args.date
     elif args.month:
-        # Define first day of given moment
-        target_date = datetime.strptime(args.month, "%Y-%m").date()
+        # Define first day of given month
+        start_date = parse_date(args.month, "%Y-%m")
         # Define last day of month by going to first day of next month and then one day back
-        target_date = (target_date.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return start_date, end_date, start_date.strftime("%Y-%m")
     elif args.year:
         # Define first day of given year
-        target_date = datetime.strptime(args.year, "%Y").date().replace(month=1, day=1)
-        # Define last day of year by going to first day of next year and then one day back
-        target_date = (target_date.replace(year=target_date.year + 1) - timedelta(days=1))
+        start_date = parse_date(args.year, "%Y")
+        # Define last day of year
+        end_date = start_date.replace(month=12, day=31)
+        return start_date, end_date, start_date.strftime("%Y")
     else:
         target_date = get_current_time()  # Default to current date if not given any
+        return target_date, target_date, target_date.strftime("%Y-%m-%d")
 
-    # Get sold products in given period
-    sold_products = (
-        get_sold_products_on_date(target_date) if args.date else
-        get_sold_products_in_period(target_date)
-    )
-
-    # Calculate total revenue en show sold products
-    total_revenue = sum(float(product["sell_price"]) for product in sold_products)
-
-    # Maak lege lijsten voor productnamen en bijbehorende omzetten
-    product_names = []
-    revenues = []
-
-    for product in sold_products:
-        bought_id = product["bought_id"]
-        sell_price = float(product["sell_price"])
-
-        # Find the corresponding product in bought.csv
-        with open("bought.csv", mode="r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row["id"] == bought_id:
-                    product_name = row["product_name"]
-                    product_names.append(product_name)
-                    revenues.append(sell_price)
-                    break
+def new_rollup():
+    """
+    Returns an empty revenue/profit/count rollup.
+    """
+    return {"revenue": 0.0, "profit": 0.0, "count": 0}
+
+def iter_sales(ledger, start_date, end_date):
+    """
+    Yields the products sold between start_date and end_date (inclusive) as (row, bought_product, sell_price, profit).
+    """
+    # Dates are stored as YYYY-MM-DD, so they can be compared and grouped as text without parsing them
+    start = start_date.strftime("%Y-%m-%d")
+    end = end_date.strftime("%Y-%m-%d")
+
+    for row in ledger.sold:
+        sell_date = row["sell_date"]
+        if not start <= sell_date <= end:
+            continue
+
+        sell_price = float(row["sell_price"])
+        bought_product = ledger.bought_by_id.get(row["bought_id"])
 
-    # Create a bar chart of the revenue per product
-    plt.bar(product_names, revenues, color='blue')
-    plt.xlabel('Producten')
-    plt.ylabel('Omzet')
-    plt.title(f'Omzet per product op {target_date.strftime("%Y-%m-%d")}')
-    plt.show()
+        # Sales without a matching purchase count for revenue, but not for profit
+        profit = 0.0
+        if bought_product is not None:
+            profit = sell_price - float(bought_product["buy_price"])
 
-    # Show total revenue
-    console = Console()
-    console.print(f"Total revenue of {target_date.strftime('%Y-%m-%d')}: [bold green]{total_revenue}[/bold green]")
+        yield row, bought_product, sell_price, profit
 
-def report_profit(args):
+def merge_sales(sales, keep_sales=True):
     """
-    Generates profit reports based on specified time periods and displays the results using Rich console tables.
+    Adds sales, given as (row, bought_product, sell_price, profit), to revenue, profit and count rollups per day, month and year.
+    The sales are added in the order they come in, so the same sales always give exactly the same sums.
+    Without keep_sales, the sales themselves are not kept, so the rollups of any number of sales take little memory.
     """
-    # Define current date by arguments
-    if args.today:
-        target_date = get_current_time()
-    elif args.yesterday:
-        target_date = get_current_time() - timedelta(days=1)
-    elif args.date:
-        specified_date = datetime.strptime(args.date, "%Y-%m-%d").date()
-        target_date = specified_date
-    elif args.month:
-        specified_date = datetime.strptime(args.month, "%Y-%m").date()
-        target_date = specified_date
-    elif args.year:
-        specified_date = datetime.strptime(args.year, "%Y").date()
-        target_date = specified_date
+    sales = list(sales) if keep_sales else sales
+    totals = new_rollup()
+    days = {}
+    months = {}
+    years = {}
+
+    for row, bought_product, sell_price, profit in sales:
+        sell_date = row["sell_date"]
+        for rollup in (
+            totals,
+            days.setdefault(sell_date, new_rollup()),
+            months.setdefault(sell_date[:7], new_rollup()),
+            years.setdefault(sell_date[:4], new_rollup()),
+        ):
+            rollup["revenue"] += sell_price
+            rollup["profit"] += profit
+            rollup["count"] += 1
+
+    return {"sales": sales if keep_sales else [], "total": totals, "day": days, "month": months, "year": years}
+
+def split_sold_file(chunks):
+    """
+    Splits the rows of 'sold.csv' into about the given number of (start, end) byte ranges that start and end on line boundaries.
+    Returns the fieldnames and the ranges.
+    """
+    try:
+        with open(SOLD_FILE, mode="rb") as csvfile:
+            fieldnames = csvfile.readline().decode().strip().split(",")
+            start = csvfile.tell()
+            size = os.fstat(csvfile.fileno()).st_size
+
+            boundaries = [start]
+            for chunk in range(1, chunks):
+                # Move to the start of the first line after the split point
+                csvfile.seek(start + (size - start) * chunk // chunks - 1)
+                csvfile.readline()
+                if boundaries[-1] < csvfile.tell() < size:
+                    boundaries.append(csvfile.tell())
+            boundaries.append(size)
+    except FileNotFoundError:
+        return [], []
+
+    return fieldnames, [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]]
+
+def share_buy_prices(buy_prices):
+    """
+    Gives a worker process of --jobs the buy price of every purchase by id, to join sales with.
+    """
+    WORKER_BUY_PRICES.clear()
+    WORKER_BUY_PRICES.update(buy_prices)
+
+def aggregate_sold_chunk(task):
+    """
+    Parses a byte range of 'sold.csv' in a worker process of --jobs and joins its sales between start and end (text dates)
+    with their buy price. Returns the sales as (row, sell_price, profit), in file order.
+    """
+    fieldnames, chunk_start, chunk_end, start, end = task
+    date_column = fieldnames.index("sell_date")
+
+    with open(SOLD_FILE, mode="rb") as csvfile:
+        csvfile.seek(chunk_start)
+        data = csvfile.read(chunk_end - chunk_start)
+
+    # Like the sell_date index, leave out a last row that is still being written
+    data = data[:data.rfind(b"\n") + 1]
+
+    sales = []
+    for values in csv.reader(io.StringIO(data.decode(), newline="")):
+        if not values or not start <= values[date_column] <= end:
+            continue
+
+        row = dict(zip(fieldnames, values))
+        sell_price = float(row["sell_price"])
+
+        # Sales without a matching purchase count for revenue, but not for profit
+        profit = 0.0
+        buy_price = WORKER_BUY_PRICES.get(row["bought_id"])
+        if buy_price is not None:
+            profit = sell_price - float(buy_price)
+
+        sales.append((row, sell_price, profit))
+    return sales
+
+def iter_sales_in_parallel(ledger, start_date, end_date, jobs):
+    """
+    Does the same as iter_sales for the sales in 'sold.csv', with the parsing and joining spread over worker processes.
+    The workers get the buy prices of the ledger and return their sales in the period; these are yielded in file order,
+    so all sums are taken in the same order as the serial reports and match them exactly.
+    """
+    with timed("import"):
+        import multiprocessing
+
+    fieldnames, ranges = split_sold_file(jobs * 4)
+    start = start_date.strftime("%Y-%m-%d")
+    end = end_date.strftime("%Y-%m-%d")
+    tasks = [(fieldnames, chunk_start, chunk_end, start, end) for chunk_start, chunk_end in ranges]
+    add_to_counter("bytes_read", sum(chunk_end - chunk_start for chunk_start, chunk_end in ranges))  # Read by the workers
+    buy_prices = {bought_id: row["buy_price"] for bought_id, row in ledger.bought_by_id.items()}
+
+    with timed("parse"):
+        pool = multiprocessing.Pool(jobs, initializer=share_buy_prices, initargs=(buy_prices,))
+    with pool:
+        results = pool.imap(aggregate_sold_chunk, tasks)
+        while True:
+            # Only waiting for the workers is parsing; the caller's time between sales (like rendering) is its own
+            with timed("parse"):
+                sales = next(results, None)
+            if sales is None:
+                break
+            for row, sell_price, profit in sales:
+                yield row, ledger.bought_by_id.get(row["bought_id"]), sell_price, profit
+
+def build_columns(bought, sold):
+    """
+    Converts purchases and sales to the typed NumPy columns of a ColumnarLedger: int64 ids, datetime64 dates, float64 prices
+    and product names as codes into their sorted categories. Every sale is joined with its purchase once.
+    """
+    np = import_numpy()
+
+    with timed("parse"):
+        # Numbers are converted by int and float like the row by row reports, which is faster than NumPy's
+        # conversion of string arrays; names are coded with a dict, which is faster than sorting the strings
+        bought_ids = np.fromiter(map(int, [row["id"] for row in bought]), dtype=np.int64, count=len(bought))
+        product_names = [row["product_name"] for row in bought]
+        categories = sorted(set(product_names))
+        product_codes = {product_name: code for code, product_name in enumerate(categories)}
+        sold_bought_ids = np.fromiter(map(int, [row["bought_id"] for row in sold]), dtype=np.int64, count=len(sold))
+        sell_dates = np.array([row["sell_date"] for row in sold], dtype="datetime64[D]")
+
+        # Join every sale with the last purchase of its id, like Ledger.bought_by_id (-1 if there is none)
+        unique_ids, id_codes = np.unique(bought_ids, return_inverse=True)
+        last_rows = np.full(len(unique_ids), -1)
+        np.maximum.at(last_rows, id_codes, np.arange(len(bought)))
+        positions = np.searchsorted(unique_ids, sold_bought_ids)
+        found = positions < len(unique_ids)
+        found[found] = unique_ids[positions[found]] == sold_bought_ids[found]
+        sold_rows = np.full(len(sold), -1)
+        sold_rows[found] = last_rows[positions[found]]
+
+        # The earliest sell date of every purchase, like Ledger.sell_dates; NEVER_SOLD is later than any date
+        lot_sell_dates = np.full(len(unique_ids), np.datetime64(ColumnarLedger.NEVER_SOLD))
+        np.minimum.at(lot_sell_dates, positions[found], sell_dates[found])
+
+        return {
+            "product_names": np.array(categories, dtype=str),
+            "product_codes": np.fromiter(map(product_codes.__getitem__, product_names), dtype=np.intp, count=len(bought)),
+            "buy_dates": np.array([row["buy_date"] for row in bought], dtype="datetime64[D]"),
+            "buy_prices": np.fromiter(map(float, [row["buy_price"] for row in bought]), dtype=np.float64, count=len(bought)),
+            "expiration_dates": np.array([row["expiration_date"] for row in bought], dtype="datetime64[D]"),
+            "lot_sell_dates": lot_sell_dates[id_codes],
+            "sell_dates": sell_dates,
+            "sell_prices": np.fromiter(map(float, [row["sell_price"] for row in sold]), dtype=np.float64, count=len(sold)),
+            "sold_rows": sold_rows,
+        }
+
+class ColumnarLedger:
+    """
+    Holds purchases and sales as the typed NumPy columns of build_columns, for vectorised reports with --columnar.
+    Sums are taken with np.bincount, which adds in row order, so the results match the row by row reports exactly.
+    The rows themselves are only needed to show lots and sales; without them, they are read from the CSV files on first use.
+    """
+    NEVER_SOLD = "9999-12-31"  # Sell date of unsold lots, later than any date
+
+    def __init__(self, columns, bought=None, sold=None):
+        self.np = import_numpy()
+        self.bought = bought
+        self.sold = sold
+        self.never_sold = self.np.datetime64(self.NEVER_SOLD)
+
+        self.product_names = columns["product_names"]
+        self.product_codes = columns["product_codes"]
+        self.buy_dates = columns["buy_dates"]
+        self.buy_prices = columns["buy_prices"]
+        self.expiration_dates = columns["expiration_dates"]
+        self.lot_sell_dates = columns["lot_sell_dates"]
+        self.sell_dates = columns["sell_dates"]
+        self.sell_prices = columns["sell_prices"]
+        self.sold_rows = columns["sold_rows"]
+
+    def get_rows(self):
+        """
+        Returns the purchases and sales the columns were made of, reading them from the CSV files if they weren't given.
+        """
+        if self.bought is None:
+            with timed("io"):
+                self.bought = read_csv_rows(BOUGHT_FILE)
+                self.sold = read_csv_rows(SOLD_FILE)
+        return self.bought, self.sold
+
+    def get_inventory_mask(self, target_date):
+        """
+        Returns a boolean array that is True for the purchases in stock at target_date.
+        """
+        target = self.np.datetime64(target_date)
+        return (self.buy_dates <= target) & (self.lot_sell_dates > target)
+
+    def iter_inventory_at_date(self, target_date):
+        """
+        Yields the rows of the purchases in stock at target_date, like iter_inventory_at_date.
+        """
+        bought, sold = self.get_rows()
+        yield from map(bought.__getitem__, self.np.flatnonzero(self.get_inventory_mask(target_date)).tolist())
+
+    def group_inventory_at_date(self, target_date):
+        """
+        Aggregates the purchases in stock at target_date per product, like group_inventory.
+        """
+        np = self.np
+        mask = self.get_inventory_mask(target_date)
+        codes = self.product_codes[mask]
+        size = len(self.product_names)
+
+        counts = np.bincount(codes, minlength=size)
+        total_costs = np.bincount(codes, weights=self.buy_prices[mask], minlength=size)
+        nearest_expiration_dates = np.full(size, self.never_sold)
+        np.minimum.at(nearest_expiration_dates, codes, self.expiration_dates[mask])
+
+        groups = []
+        for code in np.flatnonzero(counts).tolist():
+            count = int(counts[code])
+            total_cost = float(total_costs[code])
+            groups.append({
+                "product_name": str(self.product_names[code]),
+                "count": count,
+                "total_cost": total_cost,
+                "nearest_expiration_date": str(nearest_expiration_dates[code]),
+                "average_cost": total_cost / count,
+            })
+        return groups
+
+    def get_rollups(self, keys, sell_prices, profits):
+        """
+        Sums revenue and profit and counts the sales per key (an array of dates), like new_rollup and merge_sales.
+        """
+        np = self.np
+        labels, codes = np.unique(keys, return_inverse=True)
+        revenues = np.bincount(codes, weights=sell_prices, minlength=len(labels)).tolist()
+        profit_sums = np.bincount(codes, weights=profits, minlength=len(labels)).tolist()
+        counts = np.bincount(codes, minlength=len(labels)).tolist()
+        return {
+            label: {"revenue": revenue, "profit": profit, "count": count}
+            for label, revenue, profit, count in zip(labels.astype(str).tolist(), revenues, profit_sums, counts)
+        }
+
+    def aggregate_sales(self, start_date, end_date, keep_sales=True):
+        """
+        Collects the products sold between start_date and end_date (inclusive), like merge_sales.
+        Without keep_sales, only the rollups are computed and the sales aren't joined with their rows.
+        """
+        np = self.np
+        selected = np.flatnonzero((self.sell_dates >= np.datetime64(start_date)) & (self.sell_dates <= np.datetime64(end_date)))
+        sell_prices = self.sell_prices[selected]
+        bought_rows = self.sold_rows[selected]
+        sell_dates = self.sell_dates[selected]
+
+        # Sales without a matching purchase count for revenue, but not for profit
+        matched = bought_rows >= 0
+        profits = np.zeros(len(selected))
+        profits[matched] = sell_prices[matched] - self.buy_prices[bought_rows[matched]]
+
+        # Join the rows without a Python loop; bought_row -1 picks the None at the end
+        sales = []
+        if keep_sales:
+            bought, sold = self.get_rows()
+            bought = bought + [None]
+            sales = list(zip(
+                map(sold.__getitem__, selected.tolist()),
+                map(bought.__getitem__, bought_rows.tolist()),
+                sell_prices.tolist(),
+                profits.tolist(),
+            ))
+        # The totals are a single group of all sales
+        everything = np.zeros(len(selected), dtype=np.intp)
+        totals = {
+            "revenue": np.bincount(everything, weights=sell_prices, minlength=1).tolist()[0],
+            "profit": np.bincount(everything, weights=profits, minlength=1).tolist()[0],
+            "count": len(selected),
+        }
+
+        return {
+            "sales": sales,
+            "total": totals,
+            "day": self.get_rollups(sell_dates, sell_prices, profits),
+            "month": self.get_rollups(sell_dates.astype("datetime64[M]"), sell_prices, profits),
+            "year": self.get_rollups(sell_dates.astype("datetime64[Y]"), sell_prices, profits),
+        }
+
+def load_columnar_ledger(storage, load_ledger):
+    """
+    Loads a columnar ledger. The columns of the CSV files are kept in 'columns.npz' until 'bought.csv' or 'sold.csv' changes,
+    so most reports only read typed arrays; otherwise they are made from the cached rows of both files, without a Ledger.
+    Other storages load the ledger with load_ledger, which only reads the rows the command needs.
+    """
+    np = import_numpy()
+
+    if not isinstance(storage, CsvStorage):
+        ledger = load_ledger()
+        return ColumnarLedger(build_columns(ledger.bought, ledger.sold), ledger.bought, ledger.sold)
+
+    fingerprint = json.dumps(storage.fingerprint())
+    with timed("io"):
+        try:
+            with np.load(COLUMN_CACHE_FILE) as cached:
+                if str(cached["fingerprint"]) == fingerprint:
+                    return ColumnarLedger({name: cached[name] for name in cached.files})
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            pass  # A missing or damaged cache is made again
+
+        bought = read_csv_rows(BOUGHT_FILE)
+        sold = read_csv_rows(SOLD_FILE)
+
+    columns = build_columns(bought, sold)
+
+    # The cache only saves time, so failing to write it is ignored
+    with timed("io"):
+        buffer = io.BytesIO()
+        np.savez(buffer, fingerprint=fingerprint, **columns)
+        try:
+            write_file_atomic(COLUMN_CACHE_FILE, buffer.getvalue())
+        except OSError:
+            pass
+    return ColumnarLedger(columns, bought, sold)
+
+def iter_period_sales(args, storage, start_date, end_date):
+    """
+    Loads the sales of a period and yields them as (row, bought_product, sell_price, profit) as they are computed:
+    from the archives and the working files for periods before the archive cutoff (see 'compact'), in worker processes
+    if --jobs is more than 1 and the data is in CSV files, and row by row otherwise.
+    """
+    rollup = load_archive_rollup()
+    if rollup is not None and end_date.strftime("%Y-%m-%d") < rollup["before"]:
+        # Sales registered after the last compact can be dated before the cutoff, and are only in the working files
+        yield from iter_archived_sales(start_date, end_date)
+        yield from iter_sales(storage.load_period_ledger(start_date, end_date), start_date, end_date)
+    elif args.jobs > 1 and isinstance(storage, CsvStorage):
+        yield from iter_sales_in_parallel(storage.load_purchase_ledger(), start_date, end_date, args.jobs)
     else:
-        target_date = get_current_time()  # Default to current date when no date is given
+        yield from iter_sales(storage.load_period_ledger(start_date, end_date), start_date, end_date)
 
-    # Get sold products in given period
-    sold_products = (
-        get_sold_products_on_date(target_date) if args.date else
-        get_sold_products_in_period(target_date)
-    )
+def aggregate_period_sales(args, storage, start_date, end_date, keep_sales=True):
+    """
+    Loads and aggregates the sales of a period: from the rollup of archived sales for periods before the archive cutoff,
+    with the columnar ledger if --columnar is given, and see iter_period_sales otherwise.
+    """
+    rollup = load_archive_rollup()
+    if rollup is not None and end_date.strftime("%Y-%m-%d") < rollup["before"]:
+        # The rollup answers the period alone, unless sales dated in it were registered after the last compact
+        sales = list(iter_sales(storage.load_period_ledger(start_date, end_date), start_date, end_date))
+        if not sales:
+            return aggregate_archived_sales(rollup, start_date, end_date, keep_sales)
+        return merge_sales(itertools.chain(iter_archived_sales(start_date, end_date), sales), keep_sales)
+
+    if args.columnar:
+        return load_columnar_ledger(storage, lambda: storage.load_period_ledger(start_date, end_date)).aggregate_sales(start_date, end_date, keep_sales)
+    return merge_sales(iter_period_sales(args, storage, start_date, end_date), keep_sales)
+
+def write_records(records, fieldnames, output_format):
+    """
+    Writes records (dicts) to stdout as JSON, JSON Lines or CSV one at a time, as they are computed.
+    The JSON array is written piece by piece too, so no format needs all records in memory. Returns the number of records.
+    """
+    count = 0
+    if output_format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    elif output_format == "jsonl":
+        for record in records:
+            sys.stdout.write(json.dumps(record) + "\n")
+            count += 1
+    else:
+        sys.stdout.write("[")
+        for record in records:
+            sys.stdout.write(("," if count else "") + "\n" + json.dumps(record))
+            count += 1
+        sys.stdout.write("\n]\n" if count else "]\n")
+    return count
+
+def get_chart_revenues(aggregate, chart_by):
+    """
+    Adds up the revenue in an aggregate per product (sales with a matching purchase only) or per day, for a bar chart.
+    Returns the labels and revenues, sorted by label.
+    """
+    if chart_by == "day":
+        revenues = {day: rollup["revenue"] for day, rollup in aggregate["day"].items()}
+    else:
+        revenues = {}
+        for product, bought_product, sell_price, profit in aggregate["sales"]:
+            if bought_product is not None:
+                product_name = bought_product["product_name"]
+                revenues[product_name] = revenues.get(product_name, 0.0) + sell_price
+
+    labels = sorted(revenues)
+    return labels, [revenues[label] for label in labels]
 
-    # Calculate the total profit and display a summary of sold products with profit per product
-    total_profit = 0
+def report_revenue(args, storage):
+    """
+    Generates revenue reports based on specified time periods and displays the results using matplotlib.
+    The chart is shown, saved to a PNG or SVG file with --chart, or skipped with --no-chart.
+    """
+    # Define period by arguments
+    start_date, end_date, description = get_report_period(args)
+
+    # Get sold products in given period; the sales themselves are only needed for a chart per product
+    chart_per_product = args.format == "table" and not args.no_chart and args.chart_by == "product"
+    aggregate = aggregate_period_sales(args, storage, start_date, end_date, keep_sales=chart_per_product)
+    total_revenue = aggregate["total"]["revenue"]
+    breakdown = "day" if args.month else "month" if args.year else None
+
+    # Write the revenue per day or month and the total for other programs
+    if args.format != "table":
+        records = [
+            {"period": period, "period_type": breakdown, "revenue": rollup["revenue"], "count": rollup["count"]}
+            for period, rollup in sorted(aggregate[breakdown].items())
+        ] if breakdown else []
+        records.append({"period": description, "period_type": "total", "revenue": total_revenue, "count": aggregate["total"]["count"]})
+        with timed("render"):
+            write_records(records, ["period", "period_type", "revenue", "count"], args.format)
+        return
+
+    # Create a bar chart of the revenue per product or per day
+    if not args.no_chart:
+        labels, revenues = get_chart_revenues(aggregate, args.chart_by)
+        plt = import_pyplot(headless=args.chart is not None)
+        with timed("render"):
+            figure, axes = plt.subplots()
+            axes.bar(labels, revenues, color='blue')
+            axes.set_xlabel('Dagen' if args.chart_by == "day" else 'Producten')
+            axes.set_ylabel('Omzet')
+            axes.set_title(f"Omzet per {'dag' if args.chart_by == 'day' else 'product'} op {description}")
+            if len(labels) > 10:
+                axes.tick_params(axis="x", labelrotation=90)
+            figure.tight_layout()
+
+            if args.chart is not None:
+                figure.savefig(args.chart)
+                plt.close(figure)
+                print(f"OK: Saved chart to {args.chart}.")
+            else:
+                plt.show()
+
+    Console, Table = import_rich()
+    with timed("render"):
+        # Show revenue per day for a month and per month for a year
+        console = Console()
+        if breakdown:
+            for period, rollup in sorted(aggregate[breakdown].items()):
+                console.print(f"  {period}: {rollup['revenue']} ({rollup['count']} sold)")
+
+        # Show total revenue
+        console.print(f"Total revenue of {description}: [bold green]{total_revenue}[/bold green]")
+
+def report_profit(args, storage):
+    """
+    Generates profit reports based on specified time periods and displays the results using Rich console tables.
+    """
+    # Define period by arguments
+    start_date, end_date, description = get_report_period(args)
+
+    # Write every sale for other programs as it is computed
+    if args.format != "table":
+        records = (
+            {
+                "sale_id": row["id"],
+                "bought_id": row["bought_id"],
+                "product_name": bought_product["product_name"] if bought_product is not None else None,
+                "sell_date": row["sell_date"],
+                "sell_price": sell_price,
+                "buy_price": float(bought_product["buy_price"]) if bought_product is not None else None,
+                "profit": profit,
+            }
+            for row, bought_product, sell_price, profit in iter_period_sales(args, storage, start_date, end_date)
+        )
+        with timed("render"):
+            write_records(records, ["sale_id", "bought_id", "product_name", "sell_date", "sell_price", "buy_price", "profit"], args.format)
+        return
+
+    # Get sold products in given period
+    aggregate = aggregate_period_sales(args, storage, start_date, end_date)
 
     # Use Rich for better output
-    console = Console()
-
-    table = Table(show_header=True, header_style="bold magenta")
-    table.add_column("Product Name", style="dim", width=15)
-    table.add_column("Sold Price", justify="center", style="dim")
-    table.add_column("Cost", justify="center", style="dim")
-    table.add_column("Profit", style="dim")
-
-    for product in sold_products:
-        bought_id = product["bought_id"]
-        sell_price = float(product["sell_price"])
-
-        # Find the corresponding product in bought.csv
-        with open("bought.csv", mode="r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row["id"] == bought_id:
-                    product_name = row["product_name"]
-                    buy_price = float(row["buy_price"])
-
-                    # Calculate profit for this product
-                    profit = sell_price - buy_price
-                    total_profit += profit
-
-                    # Add data to Rich-table
-                    table.add_row(product_name, f"{sell_price:.2f}", f"{buy_price:.2f}", f"{profit:.2f}")
-                    break
+    Console, Table = import_rich()
 
-    console.print(table)
+    with timed("render"):
+        console = Console()
 
-    console.print(f"Total profit: [bold green]{total_profit:.2f}[/bold green]")
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Product Name", style="dim", width=15)
+        table.add_column("Sold Price", justify="center", style="dim")
+        table.add_column("Cost", justify="center", style="dim")
+        table.add_column("Profit", style="dim")
+
+        # Display a summary of sold products with profit per product
+        for product, bought_product, sell_price, profit in aggregate["sales"]:
+            if bought_product is not None:
+                buy_price = float(bought_product["buy_price"])
+                table.add_row(bought_product["product_name"], f"{sell_price:.2f}", f"{buy_price:.2f}", f"{profit:.2f}")
+
+        console.print(table)
+
+        console.print(f"Total profit of {description}: [bold green]{aggregate['total']['profit']:.2f}[/bold green]")
+
+
+def execute_request(parser, storage, request):
+    """
+    Executes a command sent to the server and returns everything it printed.
+    """
+    output = io.StringIO()
+    with redirect_stdout(output), redirect_stderr(output):
+        try:
+            args = parser.parse_args(request["argv"])
+            check_arguments(parser, args)
+        except SystemExit:
+            return output.getvalue()
+
+        if args.command in LOCAL_COMMANDS or args.command in SERVER_REFUSED_COMMANDS:
+            print(f"ERROR: '{args.command}' can't be executed by the server.")
+            return output.getvalue()
+
+        # Batch files are read as the client sees them
+        stdin = sys.stdin
+        if getattr(args, "from_file", None) == "-":
+            sys.stdin = io.StringIO(request.get("stdin") or "")
+        elif getattr(args, "from_file", None):
+            args.from_file = os.path.join(request["cwd"], args.from_file)
+
+        # Charts are saved where the client is, and never shown by the server
+        if args.command == "report-revenue":
+            if args.chart is not None:
+                args.chart = os.path.join(request["cwd"], args.chart)
+            else:
+                args.no_chart = True
 
+        try:
+            with storage_lock():
+                storage.refresh()
+                try:
+                    run_command(args, storage, get_current_time())
+                finally:
+                    storage.remember_fingerprint()
+        except Exception as e:
+            print(f"ERROR: {e}")
+        finally:
+            sys.stdin = stdin
+
+    return output.getvalue()
+
+def serve(socket_path, storage):
+    """
+    Keeps the ledger of the storage in memory and executes commands sent by 'super.py --server' over a Unix socket.
+    Every request is one line of JSON with the arguments of the command; the reply is one line of JSON with its output.
+    Commands are executed one at a time, so they can't get in each other's way.
+    """
+    import asyncio
+
+    parser = build_parser()
+    with storage_lock():
+        hot_storage = HotStorage(storage)
+
+    async def handle_client(reader, writer):
+        # Every request gets a reply, also a broken one, so the client never waits without an answer
+        try:
+            request = json.loads(await reader.readline())
+            if not isinstance(request, dict) or not isinstance(request.get("argv"), list):
+                output = "ERROR: The request has no list of arguments.\n"
+            else:
+                output = execute_request(parser, hot_storage, request)
+        except ValueError:
+            output = "ERROR: The request is not a line of valid JSON.\n"
+        except Exception as e:
+            output = f"ERROR: {e}\n"
+        writer.write(json.dumps({"output": output}).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    async def run_server():
+        # Batches sent over stdin can be large, so don't limit the length of a request
+        server = await asyncio.start_unix_server(handle_client, path=socket_path, limit=2 ** 30)
+        print(f"OK: Serving {len(hot_storage.ledger.bought)} purchases and {len(hot_storage.ledger.sold)} sales on {socket_path}.")
+        async with server:
+            await server.serve_forever()
+
+    # Remove the socket of a server that stopped earlier
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        print("OK: Server stopped.")
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def send_to_server(socket_path, args):
+    """
+    Sends the command on the command line to a SuperPy server and prints its output.
+    """
+    import socket
+
+    # Pass on the arguments without --server, and stdin for batches read from it
+    argv = sys.argv[1:]
+    if "--server" in argv:
+        del argv[argv.index("--server"):argv.index("--server") + 2]
+    argv = [argument for argument in argv if not argument.startswith("--server=")]
+    request = {"argv": argv, "cwd": os.getcwd()}
+    if getattr(args, "from_file", None) == "-":
+        request["stdin"] = sys.stdin.read()
+
+    with timed("io"):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                client.sendall(json.dumps(request).encode() + b"\n")
+                client.shutdown(socket.SHUT_WR)
+                response = client.makefile("rb").read()
+        except OSError as e:
+            print(f"ERROR: Can't reach the server at {socket_path}: {e}")
+            return
+
+    sys.stdout.write(json.loads(response)["output"])
+
+def build_parser():
+    """
+    Builds the parser for the command-line arguments of SuperPy.
+    """
+    parser = argparse.ArgumentParser(description="SuperPy - Inventory Management System")
+    parser.add_argument("--timing", action="store_true", help="Print how long importing, parsing, reading/writing and rendering took")
+    parser.add_argument("--metrics", action="store_true", help=f"Append the timings and the number of file opens, parsed rows and dates and bytes read to '{METRICS_FILE}'")
+    parser.add_argument("--profile", action="store_true", help=f"Run the command with cProfile, save the statistics to '{PROFILE_FILE}' and write --metrics")
+    parser.add_argument("--server", help="Let a SuperPy server listening on this Unix socket execute the command (see 'serve')")
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default=os.environ.get("SUPERPY_STORAGE", "csv"), help="Where purchases and sales are stored (default: csv, or $SUPERPY_STORAGE)")
+    parser.add_argument("--columnar", action="store_true", help="Compute inventory and reports with NumPy arrays instead of row by row (needs NumPy)")
+
+    # Subparsers 
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    # Buy command
+    buy_parser = subparsers.add_parser("buy", help="Buy products")
+    buy_parser.add_argument("--product-name", help="Name of the product")
+    buy_parser.add_argument("--price", type=float, help="Price of the product")
+    buy_parser.add_argument("--expiration-date", help="Expiration date of the product (format: YYYY-MM-DD)")
+    buy_parser.add_argument("--from-file", help="Buy all products in a CSV or JSON Lines file with product_name, price and expiration_date ('-' for stdin)")
+
+    # Sell command
+    sell_parser = subparsers.add_parser("sell", help="Sell products")
+    sell_parser.add_argument("--product-name", help="Name of the product")
+    sell_parser.add_argument("--price", type=float, help="Price at which the product is sold")
+    sell_parser.add_argument("--from-file", help="Sell all products in a CSV or JSON Lines file with product_name and price ('-' for stdin)")
+
+    # Inventory command
+    inventory_parser = subparsers.add_parser("inventory", help="View inventory")
+    inventory_parser.add_argument("--now", action="store_true", help="View current inventory")
+    inventory_parser.add_argument("--yesterday", action="store_true", help="View inventory as of yesterday")
+    inventory_parser.add_argument("--date", help="Inventory for a specific date (format: YYYY-MM-DD)")
+    inventory_parser.add_argument("--group", action="store_true", help="Show one row per product with count, total and average cost and nearest expiration date")
+    inventory_parser.add_argument("--stream", action="store_true", help="Write a plain text table while it is computed, for huge inventories")
+    inventory_parser.add_argument("--format", choices=["table", "json", "jsonl", "csv"], default="table", help="Write a table, or the lots or groups as JSON, JSON Lines or CSV for other programs (default: table)")
+
+    # Report expiring command
+    expiring_parser = subparsers.add_parser("report-expiring", help="View products in stock that expire soon")
+    expiring_parser.add_argument("--within", type=int, default=7, help="Number of days from today to look ahead (default: 7)")
+
+    # Report revenue command
+    revenue_parser = subparsers.add_parser("report-revenue", help="Generate revenue reports")
+    revenue_parser.add_argument("--yesterday", action="store_true", help="Revenue from yesterday")
+    revenue_parser.add_argument("--today", action="store_true", help="Revenue so far today")
+    revenue_parser.add_argument("--date", help="Revenue for a specific day (format: YYYY-MM-DD)")
+    revenue_parser.add_argument("--month", help="Revenue for a specific month (format: YYYY-MM)")
+    revenue_parser.add_argument("--year", help="Revenue for a specific year (format: YYYY)")
+    chart_group = revenue_parser.add_mutually_exclusive_group()
+    chart_group.add_argument("--chart", help="Save the chart to a PNG or SVG file instead of showing it, without a display")
+    chart_group.add_argument("--no-chart", action="store_true", help="Skip the chart, for large periods and batch jobs")
+    revenue_parser.add_argument("--chart-by", choices=["product", "day"], default="product", help="Show revenue per product or per day in the chart (default: product)")
+    revenue_parser.add_argument("--format", choices=["table", "json", "jsonl", "csv"], default="table", help="Write the usual output, or the revenue per day or month and the total as JSON, JSON Lines or CSV for other programs (default: table)")
+    revenue_parser.add_argument("--jobs", type=int, default=1, help="Number of processes that read sold.csv, for long periods (default: 1)")
+
+    # Advance-time command
+    advance_time_parser = subparsers.add_parser("advance-time", help="Advance or reset the current date")
+    advance_time_parser.add_argument("days", type=int, default=0, nargs="?", help="Number of days to advance (default: 0)")
+    advance_time_parser.add_argument("--reset", action="store_true", help="Reset the date to the current date")
+    advance_time_parser.add_argument("--set-date", help="Set a specific date (format: YYYY-MM-DD)")
+
+    # Report profit command
+    profit_parser = subparsers.add_parser("report-profit", help="Generate profit reports")
+    profit_parser.add_argument("--today", action="store_true", help="Profit so far today")
+    profit_parser.add_argument("--yesterday", action="store_true", help="Yesterday's profit")
+    profit_parser.add_argument("--date", help="Profit for a specific date (format: YYYY-MM-DD)")
+    profit_parser.add_argument("--month", help="Profit for a specific month (format: YYYY-MM)")
+    profit_parser.add_argument("--year", help="Profit for a specific year (format: YYYY)")
+    profit_parser.add_argument("--format", choices=["table", "json", "jsonl", "csv"], default="table", help="Write a table, or the sales as JSON, JSON Lines or CSV for other programs (default: table)")
+    profit_parser.add_argument("--jobs", type=int, default=1, help="Number of processes that read sold.csv, for long periods (default: 1)")
+
+    # Check-ids command
+    check_ids_parser = subparsers.add_parser("check-ids", help="Find purchases and sales that share an id")
+    check_ids_parser.add_argument("--repair", action="store_true", help="Give rows with a repeated id a new unique id")
+
+    # Checkpoint command
+    checkpoint_parser = subparsers.add_parser("checkpoint", help="Save the stock per day or month, to speed up inventory for past dates")
+    checkpoint_parser.add_argument("--every", choices=["day", "month"], default="month", help="Save the stock at the end of every day or month (default: month)")
+
+    # Compact command
+    compact_parser = subparsers.add_parser("compact", help=f"Move sold lots of past years and their sales to the '{ARCHIVE_DIRECTORY}' directory")
+    compact_parser.add_argument("--before", type=int, help="Archive the lots that were sold before this year (format: YYYY, default: the current year)")
+
+    # Reindex command
+    subparsers.add_parser("reindex", help="Rebuild the sell_date index of sold.csv")
+
+    # Import and export commands
+    subparsers.add_parser("import", help=f"Copy bought.csv and sold.csv into the SQLite storage ({DATABASE_FILE})")
+    subparsers.add_parser("export", help=f"Copy the SQLite storage ({DATABASE_FILE}) to bought.csv and sold.csv")
+
+    # Serve command
+    serve_parser = subparsers.add_parser("serve", help="Keep the ledger in memory and execute commands sent with --server")
+    serve_parser.add_argument("--socket", default=SOCKET_FILE, help=f"Unix socket to listen on (default: {SOCKET_FILE})")
+
+    return parser
+
+
+def check_arguments(parser, args):
+    """
+    Checks the combinations of arguments that argparse can't check by itself.
+    """
+    # Single purchases and sales need all their arguments, batches come with their own
+    if args.command == "buy" and not args.from_file:
+        if args.product_name is None or args.price is None or args.expiration_date is None:
+            parser.error("--product-name, --price and --expiration-date are required without --from-file")
+    if args.command == "sell" and not args.from_file:
+        if args.product_name is None or args.price is None:
+            parser.error("--product-name and --price are required without --from-file")
+
+    if getattr(args, "jobs", 1) < 1:
+        parser.error("--jobs must be at least 1")
+    if getattr(args, "jobs", 1) > 1 and args.columnar:
+        parser.error("--jobs can't be combined with --columnar")
+
+    # Charts are saved in the format of their extension, so only PNG and SVG are accepted
+    if getattr(args, "chart", None) is not None and os.path.splitext(args.chart)[1].lower() not in (".png", ".svg"):
+        parser.error("--chart must be a .png or .svg file")
+
+    # NumPy is optional, so it is only needed when it is asked for
+    if args.columnar and import_numpy() is None:
+        parser.error("--columnar needs NumPy, install it with 'pip install numpy'")
 
 def main():
     """
     The main entry point for the SuperPy program, responsible for parsing command-line arguments and executing corresponding commands.
     """
-    console = Console()
+    PHASE_TIMES["import"] += time.perf_counter() - IMPORT_START
 
     # Check if the welcome message has already been displayed
     welcome_file = "welcome_shown.txt"
 
     if not os.path.exists(welcome_file):
+        Console, Table = import_rich()
+        console = Console()
+
         # Welcome message
         console.print("[bold cyan]=== SuperPy - Inventory Management System ===[/bold cyan]")
         console.print("[italic]Welcome to SuperPy, your friendly neighborhood inventory manager![/italic]")
@@ -418,49 +2583,46 @@ def main():
 
     current_time = get_current_time()  # Get current time
 
-    parser = argparse.ArgumentParser(description="SuperPy - Inventory Management System")
-
-    # Subparsers 
-    subparsers = parser.add_subparsers(dest="command", help="Available commands")
-
-    # Buy command
-    buy_parser = subparsers.add_parser("buy", help="Buy products")
-    buy_parser.add_argument("--product-name", required=True, help="Name of the product")
-    buy_parser.add_argument("--price", type=float, required=True, help="Price of the product")
-    buy_parser.add_argument("--expiration-date", required=True, help="Expiration date of the product (format: YYYY-MM-DD)")
-
-    # Sell command
-    sell_parser = subparsers.add_parser("sell", help="Sell products")
-    sell_parser.add_argument("--product-name", required=True, help="Name of the product")
-    sell_parser.add_argument("--price", type=float, required=True, help="Price at which the product is sold")
+    parser = build_parser()
+    with timed("parse"):
+        args = parser.parse_args()
+        check_arguments(parser, args)
 
-    # Inventory command
-    inventory_parser = subparsers.add_parser("inventory", help="View inventory")
-    inventory_parser.add_argument("--now", action="store_true", help="View current inventory")
-    inventory_parser.add_argument("--yesterday", action="store_true", help="View inventory as of yesterday")
-    inventory_parser.add_argument("--date", help="Inventory for a specific date (format: YYYY-MM-DD)")
+    # Count the work done by the command, and profile it if asked for
+    if args.metrics or args.profile:
+        sys.addaudithook(count_file_opens)
 
-    # Report revenue command
-    revenue_parser = subparsers.add_parser("report-revenue", help="Generate revenue reports")
-    revenue_parser.add_argument("--yesterday", action="store_true", help="Revenue from yesterday")
-    revenue_parser.add_argument("--today", action="store_true", help="Revenue so far today")
-    revenue_parser.add_argument("--date", help="Revenue for a specific day (format: YYYY-MM-DD)")
-    revenue_parser.add_argument("--month", help="Revenue for a specific month (format: YYYY-MM)")
-    revenue_parser.add_argument("--year", help="Revenue for a specific year (format: YYYY)")
-
-    # Advance-time command
-    advance_time_parser = subparsers.add_parser("advance-time", help="Advance or reset the current date")
-    advance_time_parser.add_argument("days", type=int, default=0, nargs="?", help="Number of days to advance (default: 0)")
-    advance_time_parser.add_argument("--reset", action="store_true", help="Reset the date to the current date")
-    advance_time_parser.add_argument("--set-date", help="Set a specific date (format: YYYY-MM-DD)")
-
-    # Report profit command
-    profit_parser = subparsers.add_parser("report-profit", help="Generate profit reports")
-    profit_parser.add_argument("--today", action="store_true", help="Profit so far today")
-    profit_parser.add_argument("--yesterday", action="store_true", help="Yesterday's profit")
-    profit_parser.add_argument("--date", help="Profit for a specific date (format: YYYY-MM-DD)")
+    try:
+        if args.profile:
+            with timed("import"):
+                import cProfile
+            profile = cProfile.Profile()
+            profile.runcall(dispatch_command, args)
+            save_profile(profile)
+        else:
+            dispatch_command(args)
+    except BrokenPipeError:
+        # The output was piped to a program that stopped reading (like 'head'). Send the rest to devnull,
+        # so flushing stdout at exit doesn't fail again, and stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+    total = time.perf_counter() - IMPORT_START
+    if args.timing:
+        print_timing(total)
+    if args.metrics or args.profile:
+        save_metrics(args, total)
+
+def dispatch_command(args):
+    """
+    Executes a parsed command: sends it to a server with --server, and runs it here otherwise.
+    """
+    global current_time  # Make the global variable available for modifications.
 
-    args = parser.parse_args()
+    # Let a running server execute the command
+    if args.server and args.command not in LOCAL_COMMANDS:
+        send_to_server(args.server, args)
+        return
 
     if args.command == "advance-time":
         if args.reset:
@@ -471,7 +2633,7 @@ def main():
         elif args.set_date:
             # Set a specific date
             try:
-                current_time = datetime.strptime(args.set_date, "%Y-%m-%d").date()
+                current_time = parse_date(args.set_date, "%Y-%m-%d")
                 save_current_time(current_time)
                 print(f"OK: Date set to {args.set_date}.")
             except ValueError:
@@ -482,12 +2644,23 @@ def main():
             current_time += timedelta(days=days_to_advance)
             save_current_time(current_time)
             print(f"OK: Time advanced by {days_to_advance} days. Current date is now {current_time.strftime('%Y-%m-%d')}.")
+    elif args.command == "serve":
+        serve(args.socket, get_storage(args.storage))
+    else:
+        # Commands that use the storage run one at a time
+        with storage_lock():
+            run_command(args, get_storage(args.storage), current_time)
 
-        return
+def run_command(args, storage, current_time):
+    """
+    Executes a parsed command that uses the storage.
+    """
+    if args.command == "buy" and args.from_file:
+        buy_products_from_file(args.from_file, storage, current_time)
 
-    if args.command == "buy":
+    elif args.command == "buy":
         # Generate unique ID
-        product_id = int(datetime.now().timestamp())
+        product_id = generate_ids(1)[0]
 
         # Format date 
         buy_date = current_time.strftime("%Y-%m-%d")
@@ -501,23 +2674,14 @@ def main():
             buy_price = args.price
             expiration_date = args.expiration_date
 
-            # Write to bought.csv
-            with open("bought.csv", mode="a", newline="") as csvfile:
-                fieldnames = ["id", "product_name", "buy_date", "buy_price", "expiration_date"]
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                # Write header if file is empty
-                if csvfile.tell() == 0:
-                    writer.writeheader()
-
-                # Write data
-                writer.writerow({
-                    "id": product_id,
-                    "product_name": product_name,
-                    "buy_date": buy_date,
-                    "buy_price": buy_price,
-                    "expiration_date": expiration_date
-                })
+            # Write to storage
+            storage.append_bought([{
+                "id": product_id,
+                "product_name": product_name,
+                "buy_date": buy_date,
+                "buy_price": str(buy_price),
+                "expiration_date": expiration_date
+            }])
 
             # Show summary
             summary_message = f"Product '{product_name}' (ID: {product_id}) bought for {buy_price} on {buy_date}. Expires on {expiration_date}."
@@ -528,22 +2692,57 @@ def main():
             print(f"ERROR: {e}")
 
 
-    if args.command == "sell":
+    if args.command == "sell" and args.from_file:
+        sell_products_from_file(args.from_file, storage.load_ledger(), current_time)
+
+    elif args.command == "sell":
         # Extracting values from the arguments
         product_name = args.product_name
         sell_price = args.price
 
         # Attempt to sell the product
-        sell_product(product_name, sell_price)
+        sell_product(product_name, sell_price, storage.load_product_ledger(product_name))
 
     if args.command == "inventory":
-        report_inventory(args)
+        report_inventory(args, storage)
+
+    if args.command == "report-expiring":
+        report_expiring(args, storage)
 
     if args.command == "report-revenue":
-        report_revenue(args)
+        report_revenue(args, storage)
 
     if args.command == "report-profit":
-        report_profit(args)
+        report_profit(args, storage)
+
+    if args.command == "check-ids":
+        check_ids(storage, args.repair)
+
+    if args.command == "checkpoint":
+        if storage.name != "csv":
+            print("ERROR: Checkpoints are only used by the csv storage, the sqlite storage answers inventory queries from its indexes.")
+        else:
+            checkpoints = build_stock_checkpoints(storage.load_ledger(), args.every)
+            print(f"OK: Saved {checkpoints} stock checkpoints in {CHECKPOINT_FILE}.")
+
+    if args.command == "compact":
+        before_year = args.before if args.before is not None else current_time.year
+        archived_bought, archived_sold = compact(storage, before_year)
+        print(f"OK: Archived {archived_bought} purchases and {archived_sold} sales from before {before_year:04d}-01-01 in {ARCHIVE_DIRECTORY}.")
+
+    if args.command == "reindex":
+        indexed_rows = build_sold_index()
+        print(f"OK: Indexed {indexed_rows} sales in {SOLD_INDEX_FILE}.")
+
+    if args.command == "import":
+        ledger = CsvStorage().load_ledger()
+        SqliteStorage().replace_all(ledger)
+        print(f"OK: Imported {len(ledger.bought)} purchases and {len(ledger.sold)} sales into {DATABASE_FILE}.")
+
+    if args.command == "export":
+        ledger = SqliteStorage().load_ledger()
+        CsvStorage().replace_all(ledger)
+        print(f"OK: Exported {len(ledger.bought)} purchases and {len(ledger.sold)} sales to {BOUGHT_FILE} and {SOLD_FILE}.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file